@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+Windowed min, max, mean, last and count for each numeric point
+
+One slot per point in flat arrays, NumPy does each cycle in a few vector
+operations when it is installed, the array module does it point by point
+when it is not
+"""
+import math
+from array import array
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# imported when the first aggregator is built, False when it isn't installed
+numpy = None
+
+
+def _import_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   Aggregator
+#
+@bacpypes_debugging
+class Aggregator:
+
+    def __init__(self, size):
+        if _debug: Aggregator._debug("__init__ %r", size)
+        _import_numpy()
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        if numpy:
+            self.mins = numpy.full(self.size, math.inf)
+            self.maxs = numpy.full(self.size, -math.inf)
+            self.sums = numpy.zeros(self.size)
+            self.lasts = numpy.zeros(self.size)
+            self.counts = numpy.zeros(self.size, dtype=numpy.int64)
+        else:
+            self.mins = array('d', [math.inf]) * self.size
+            self.maxs = array('d', [-math.inf]) * self.size
+            self.sums = array('d', [0.0]) * self.size
+            self.lasts = array('d', [0.0]) * self.size
+            self.counts = array('q', [0]) * self.size
+
+    def add(self, slots, values):
+        """Add one value for each slot, a slot appears at most once."""
+        if _debug: Aggregator._debug("add %r", len(slots))
+        if not slots:
+            return
+
+        if numpy:
+            slots = numpy.fromiter(slots, dtype=numpy.intp, count=len(slots))
+            values = numpy.fromiter(values, dtype=numpy.float64, count=len(values))
+            self.mins[slots] = numpy.minimum(self.mins[slots], values)
+            self.maxs[slots] = numpy.maximum(self.maxs[slots], values)
+            self.sums[slots] += values
+            self.lasts[slots] = values
+            self.counts[slots] += 1
+            return
+
+        mins, maxs, sums, lasts, counts = self.mins, self.maxs, self.sums, self.lasts, self.counts
+        for slot, value in zip(slots, values):
+            if value < mins[slot]:
+                mins[slot] = value
+            if value > maxs[slot]:
+                maxs[slot] = value
+            sums[slot] += value
+            lasts[slot] = value
+            counts[slot] += 1
+
+    def take(self):
+        """Return (slot, min, max, mean, last, count) for each slot that had
+        a value and start a new window."""
+        if _debug: Aggregator._debug("take")
+
+        if numpy:
+            slots = numpy.flatnonzero(self.counts)
+            counts = self.counts[slots]
+            results = list(zip(slots.tolist(), self.mins[slots].tolist(), self.maxs[slots].tolist(),
+                               (self.sums[slots] / counts).tolist(), self.lasts[slots].tolist(), counts.tolist()))
+        else:
+            results = [(slot, self.mins[slot], self.maxs[slot], self.sums[slot] / count, self.lasts[slot], count)
+                       for slot, count in enumerate(self.counts) if count]
+
+        self.reset()
+        return results
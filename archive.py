@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""
+Local archive of every raw reading
+
+Fixed width little endian records, one file per UTC hour, that can be
+memory mapped and sliced without parsing:
+
+    time    float64  seconds since the epoch
+    point   uint32   index into the catalog's points
+    kind    uint32   NUMBER, BOOLEAN, STRING or ERROR
+    value   float64  the number, 0 or 1, or an index into the catalog's strings
+
+The catalog is a JSON file beside the hourly files, appended to as new
+points and strings turn up so the numbers stay the same across restarts
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# imported when the first archive is built, False when it isn't installed
+numpy = None
+
+
+def _import_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+RECORD = struct.Struct("<dIId")
+
+# kinds of value
+NUMBER = 0
+BOOLEAN = 1
+STRING = 2
+ERROR = 3
+
+# the same layout for numpy.memmap
+DTYPE = [('time', '<f8'), ('point', '<u4'), ('kind', '<u4'), ('value', '<f8')]
+
+#
+#   Archive
+#
+@bacpypes_debugging
+class Archive:
+
+    def __init__(self, path, retention_hours, error_name=repr, buffer_bytes=65536, flush_interval=60):
+        if _debug: Archive._debug("__init__ %r %r %r %r", path, retention_hours, buffer_bytes, flush_interval)
+        _import_numpy()
+        self.path = path
+        self.error_name = error_name
+        self.retention = retention_hours * 3600
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(path, exist_ok=True)
+
+        # point keys and strings by number, and back again
+        self.points = []
+        self.strings = []
+        catalog_path = os.path.join(path, "catalog.json")
+        if os.path.exists(catalog_path):
+            with open(catalog_path) as catalog:
+                catalog = json.load(catalog)
+            self.points = [tuple(key) for key in catalog['points']]
+            self.strings = catalog['strings']
+        self.point_numbers = {key: number for number, key in enumerate(self.points)}
+        self.string_numbers = {string: number for number, string in enumerate(self.strings)}
+        self.catalog_changed = False
+
+        # records packed but not yet written, and the hour they belong to,
+        # written out when there is enough of them or they have waited long enough
+        self.buffer = bytearray()
+        self.hour = None
+        self.last_flush = time.monotonic()
+
+    def append(self, samples):
+        """Add (time, point key, value) readings, each at the time it was read."""
+        if _debug: Archive._debug("append %r", len(samples))
+
+        pack = RECORD.pack
+        for timestamp, key, value in samples:
+            # a new hour gets a new file
+            hour = int(timestamp // 3600)
+            if hour != self.hour:
+                self.flush()
+                self.hour = hour
+                self.expire(timestamp)
+
+            number = self.point_numbers.get(key)
+            if number is None:
+                number = self.point_numbers[key] = len(self.points)
+                self.points.append(key)
+                self.catalog_changed = True
+
+            if isinstance(value, bool):
+                self.buffer += pack(timestamp, number, BOOLEAN, float(value))
+            elif isinstance(value, (int, float)):
+                self.buffer += pack(timestamp, number, NUMBER, value)
+            elif isinstance(value, str):
+                self.buffer += pack(timestamp, number, STRING, self.string_number(value))
+            else:
+                self.buffer += pack(timestamp, number, ERROR, self.string_number(self.error_name(value)))
+
+        if (len(self.buffer) >= self.buffer_bytes) or (time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def string_number(self, string):
+        number = self.string_numbers.get(string)
+        if number is None:
+            number = self.string_numbers[string] = len(self.strings)
+            self.strings.append(string)
+            self.catalog_changed = True
+        return number
+
+    def flush(self):
+        if _debug: Archive._debug("flush %r", len(self.buffer))
+
+        # the catalog goes first so no record refers to an unknown number
+        if self.catalog_changed:
+            catalog_path = os.path.join(self.path, "catalog.json")
+            with open(catalog_path + ".tmp", "w") as catalog:
+                json.dump({'points': self.points, 'strings': self.strings}, catalog)
+            os.replace(catalog_path + ".tmp", catalog_path)
+            self.catalog_changed = False
+
+        if self.buffer:
+            with open(self.file_name(self.hour), "ab") as archive_file:
+                archive_file.write(self.buffer)
+            self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    def file_name(self, hour):
+        return os.path.join(self.path, time.strftime("%Y%m%dT%H", time.gmtime(hour * 3600)) + ".bin")
+
+    def expire(self, now):
+        # hourly files are named so they sort by age
+        oldest = self.file_name(int((now - self.retention) // 3600))
+        for name in sorted(os.listdir(self.path)):
+            path = os.path.join(self.path, name)
+            if not name.endswith(".bin"):
+                continue
+            if path >= oldest:
+                break
+            if _debug: Archive._debug("    - expire %r", name)
+            os.remove(path)
+
+    def read(self, start, end, key=None):
+        """Return (time, point key, value) for the records between start and
+        end, only those for one point key if given."""
+        if _debug: Archive._debug("read %r %r %r", start, end, key)
+        self.flush()
+
+        number = self.point_numbers.get(key) if key is not None else None
+        if (key is not None) and (number is None):
+            return []
+
+        results = []
+        for hour in range(int(start // 3600), int(end // 3600) + 1):
+            path = self.file_name(hour)
+            if not os.path.exists(path):
+                continue
+
+            # a record cut short by a power cut is left out
+            count = os.path.getsize(path) // RECORD.size
+            if not count:
+                continue
+
+            if numpy:
+                # select with masks over the mapped file
+                records = numpy.memmap(path, dtype=DTYPE, mode='r', shape=(count,))
+                mask = (records['time'] >= start) & (records['time'] < end)
+                if number is not None:
+                    mask &= records['point'] == number
+                rows = zip(*(records[name][mask].tolist() for name in ('time', 'point', 'kind', 'value')))
+                results.extend(self.decode(row) for row in rows)
+                del records
+                continue
+
+            with open(path, "rb") as archive_file, \
+                    mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                    memoryview(mapped) as view:
+                for row in RECORD.iter_unpack(view[:count * RECORD.size]):
+                    if (start <= row[0] < end) and ((number is None) or (row[1] == number)):
+                        results.append(self.decode(row))
+
+        return results
+
+    def decode(self, row):
+        timestamp, number, kind, value = row
+        if kind == BOOLEAN:
+            value = bool(value)
+        elif kind in (STRING, ERROR):
+            value = self.strings[int(value)]
+        return (timestamp, self.points[number], value)
+
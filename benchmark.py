@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+
+"""
+Fleet benchmark for the gateway
+
+Starts a fleet of N mock instruments on loopback ports, points a gateway
+at them with a local stand-in for Timestream and measures cycle time, reads
+per second, CPU and memory for each fleet size.  Results are written as JSON
+so runs can be compared.
+
+    python benchmark.py --counts 1,10,50,100 --cycles 10 --output bench.json
+
+Gateway settings such as READ_MODE or MAX_IN_FLIGHT are taken from the
+environment, or given with --env NAME=VALUE.
+
+The records subcommand times building one cycle's records from templates
+against building every dict afresh, without any devices:
+
+    python benchmark.py records --devices 100 --layout multi
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the gateway's own, once it has been imported
+_measure_value = None
+
+INI_TEMPLATE = """[BACpypes]
+objectName: {name}
+address: 127.0.0.1/32:{port}
+objectIdentifier: {instance}
+maxApduLengthAccepted: 1024
+segmentationSupported: segmentedBoth
+vendorIdentifier: 457
+"""
+
+#
+#   LocalTimestream
+#
+class LocalTimestream:
+
+    # the same exception names the real client has
+    class exceptions:
+        class RejectedRecordsException(Exception):
+            pass
+
+        class ThrottlingException(Exception):
+            pass
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.records = 0
+        self.bytes = 0
+
+    def write_records(self, **kwargs):
+        # stand in for the network
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.calls += 1
+        self.records += len(kwargs['Records'])
+        self.bytes += len(json.dumps(kwargs, separators=(',', ':')))
+        return {'RecordsIngested': {'Total': len(kwargs['Records'])}}
+
+
+def write_ini(directory, name, port, instance):
+    path = os.path.join(directory, name + ".ini")
+    with open(path, "w") as ini:
+        ini.write(INI_TEMPLATE.format(name=name, port=port, instance=instance))
+    return path
+
+
+def start_mocks(directory, count, base_port, process_count):
+    # the fleet split over a few processes so the mocks keep up
+    processes = []
+    process_count = min(process_count, count)
+    for i in range(process_count):
+        first = count * i // process_count
+        size = count * (i + 1) // process_count - first
+        ini = write_ini(directory, "mock%d" % i, base_port + first, 100000 + first)
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "mockinstrument.py"), "--ini", ini, "--fleet", str(size)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+    return processes
+
+
+def stop_processes(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_size(args, count):
+    with tempfile.TemporaryDirectory() as directory:
+        mocks = start_mocks(directory, count, args.base_port, args.mock_processes)
+        try:
+            # give the mocks time to bind
+            time.sleep(1 + 0.02 * count)
+
+            env = dict(os.environ)
+            env.update(
+                IP_ADDRESSES=",".join("127.0.0.1:%d" % (args.base_port + i) for i in range(count)),
+                BACNET_ADDRESSES=",".join(str(100000 + i) for i in range(count)),
+                DEVICE_TYPES=",".join([args.device_type] * count),
+                DATABASE="benchmark",
+                TABLE="benchmark",
+                )
+            for setting in args.env:
+                name, value = setting.split("=", 1)
+                env[name] = value
+
+            gateway_ini = write_ini(directory, "gateway", args.gateway_port, 99999)
+            gateway = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "gateway",
+                 "--ini", gateway_ini, "--interval", str(args.interval),
+                 "--cycles", str(args.cycles), "--warmup", str(args.warmup),
+                 "--write-latency", str(args.write_latency)],
+                env=env, stdout=subprocess.PIPE, timeout=args.timeout,
+                )
+        finally:
+            stop_processes(mocks)
+
+    # the gateway prints its results as the last line
+    result = json.loads(gateway.stdout.decode().strip().splitlines()[-1])
+    result['devices'] = count
+    return result
+
+
+def gateway(args):
+    # flexim reads its configuration from the environment on import
+    sys.path.insert(0, HERE)
+    import flexim
+    from bacpypes.core import run, stop
+    from bacpypes.apdu import AbortPDU
+    from bacpypes.local.device import LocalDeviceObject
+    from bacpypes.consolelogging import ConfigArgumentParser
+
+    flexim.client = LocalTimestream(args.write_latency)
+    flexim.clock_synced.set()
+
+    cycles = []
+    reads = []
+    timeouts = []
+
+    class BenchmarkDog(flexim.PrairieDog):
+
+        # the points read this cycle as the replies come in, before unchanged
+        # values are filtered out and without the COV notifications
+        cycle_reads = 0
+        cycle_timeouts = 0
+
+        def complete_request(self, iocb, point):
+            self.count_reads(iocb, 1)
+            flexim.PrairieDog.complete_request(self, iocb, point)
+
+        def complete_multiple_request(self, iocb, batch):
+            # a refused batch is read again one property at a time
+            if not (iocb.ioError and flexim._rpm_unsupported(iocb.ioError)):
+                self.count_reads(iocb, len(batch))
+            flexim.PrairieDog.complete_multiple_request(self, iocb, batch)
+
+        def count_reads(self, iocb, points):
+            self.cycle_reads += points
+            if isinstance(iocb.ioError, AbortPDU):
+                self.cycle_timeouts += points
+
+        def next_request(self):
+            was_busy = self.is_busy
+            flexim.PrairieDog.next_request(self)
+
+            # a cycle has just finished
+            if was_busy and not self.is_busy:
+                cycles.append(time.monotonic() - self.cycle_start)
+                reads.append(self.cycle_reads)
+                timeouts.append(self.cycle_timeouts)
+                self.cycle_reads = self.cycle_timeouts = 0
+                if len(cycles) >= args.warmup + args.cycles:
+                    stop()
+
+    # the usual bacpypes command line, just for the ini file
+    ini_args = ConfigArgumentParser().parse_args(["--ini", args.ini])
+    this_device = LocalDeviceObject(ini=ini_args.ini)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    dog = BenchmarkDog(args.interval, this_device, ini_args.ini.address)
+    run()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    # let the uploads finish
+    while not all(sink.queue.empty() for sink in dog.uploader.sinks):
+        time.sleep(0.1)
+
+    measured = cycles[args.warmup:]
+    measured_reads = reads[args.warmup:]
+    ordered = sorted(measured)
+    result = {
+        'cycles': len(measured),
+        'interval': args.interval,
+        'cycle_mean': sum(measured) / len(measured),
+        'cycle_p50': ordered[len(ordered) // 2],
+        'cycle_p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'cycle_max': ordered[-1],
+        'reads_per_cycle': sum(measured_reads) / len(measured_reads),
+        'reads_per_second': sum(measured_reads) / sum(measured),
+        'timeouts': sum(timeouts[args.warmup:]),
+        'cpu_seconds': (after.ru_utime + after.ru_stime) - (usage.ru_utime + usage.ru_stime),
+        'max_rss_mb': after.ru_maxrss / 1024,
+        'write_calls': flexim.client.calls,
+        'records_written': flexim.client.records,
+        'bytes_written': flexim.client.bytes,
+        'settings': {name: os.environ[name] for name in sorted(os.environ)
+                     if name in ('READ_MODE', 'MAX_IN_FLIGHT', 'DEVICE_IN_FLIGHT', 'RECORD_LAYOUT',
+                                 'SUBSCRIBE_COV', 'REPORT_BY_EXCEPTION', 'POLL_PERIODS')},
+        }
+    result['cpu_per_cycle'] = result['cpu_seconds'] / (args.warmup + args.cycles)
+    print(json.dumps(result))
+
+
+def fresh_records(points, values, current_time):
+    # how records were built before there were templates
+    records = []
+    channels = {}
+    for request in points:
+        if request not in values:
+            continue
+        response = values[request]
+
+        if request.measure:
+            channel, name, measureType = request.measure
+            value = _measure_value(response, measureType)
+            if value is None:
+                continue
+            key = (request.bacnet_ref, channel)
+            if key not in channels:
+                channels[key] = {
+                    'Time': current_time,
+                    'Dimensions': [{'Name': 'tag', 'Value': request.bacnet_ref},
+                                   {'Name': 'channel', 'Value': channel}],
+                    'MeasureName': 'flow_channel',
+                    'MeasureValues': [],
+                    'MeasureValueType': 'MULTI',
+                    }
+                records.append(channels[key])
+            channels[key]['MeasureValues'].append({'Name': name, 'Value': value, 'Type': measureType})
+            continue
+
+        records.append({
+            'Time': current_time,
+            'Dimensions': [{'Name': 'tag', 'Value': request.bacnet_ref},
+                           {'Name': 'BACnet_ref', 'Value': request.obj_id}],
+            'MeasureName': request.prop_id,
+            'MeasureValue': str(response),
+            'MeasureValueType': request.value_type,
+            })
+    return records
+
+
+def records(args):
+    global _measure_value
+
+    # the layout is read on import, and no devices are needed
+    os.environ.update(RECORD_LAYOUT=args.layout, IP_ADDRESSES="", DISCOVERY="false")
+    sys.path.insert(0, HERE)
+    import flexim
+    _measure_value = flexim._measure_value
+
+    point_list = []
+    for i in range(args.devices):
+        for obj_id, prop_id in flexim.MULTI_MEASURES:
+            point_list.append(("127.0.0.1:%d" % (args.base_port + i), obj_id, prop_id, str(100000 + i)))
+    points, _ = flexim.compile_points(point_list)
+
+    # a value of the right kind for each point
+    values = {}
+    for point in points:
+        if point.prop_id == 'outOfService':
+            values[point] = False
+        elif point.value_type == 'DOUBLE':
+            values[point] = 12.5 + len(values)
+        else:
+            values[point] = 'normal'
+
+    # one time for them all, the gateway stamps each reply as it comes in
+    sample_time = "1700000000000"
+    sample_times = dict.fromkeys(points, sample_time)
+
+    # the records on their own, then split into the chunks write_records
+    # sends with their CommonAttributes, which is what is held until uploaded
+    def chunked(build):
+        return lambda points, values, times: list(flexim.write_chunks(build(points, values, times)))
+
+    result = {'devices': args.devices, 'layout': args.layout, 'points': len(points), 'cycles': args.cycles}
+    for name, build, times in (('fresh', fresh_records, sample_time),
+                               ('templates', flexim.build_records, sample_times),
+                               ('fresh+chunks', chunked(fresh_records), sample_time),
+                               ('templates+chunks', chunked(flexim.build_records), sample_times)):
+        # CPU for the build alone
+        start = time.process_time()
+        for cycle in range(args.cycles):
+            build(points, values, times)
+        cpu = (time.process_time() - start) / args.cycles
+
+        # what one cycle leaves allocated until it has been uploaded
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        cycle_records = build(points, values, times)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = [stat for stat in after.compare_to(before, 'filename') if stat.count_diff > 0]
+
+        result[name] = {
+            'records': len(cycle_records),
+            'cpu_ms_per_cycle': cpu * 1000,
+            'blocks_per_cycle': sum(stat.count_diff for stat in allocated),
+            'bytes_per_cycle': sum(stat.size_diff for stat in allocated),
+            }
+        del cycle_records
+
+    for name in ('fresh', 'templates', 'fresh+chunks', 'templates+chunks'):
+        print("%-16s %6.2f ms/cycle, %6d blocks, %8d bytes allocated" % (
+            name, result[name]['cpu_ms_per_cycle'], result[name]['blocks_per_cycle'],
+            result[name]['bytes_per_cycle']))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    # the gateway side, started by the fleet side
+    gateway_parser = subparsers.add_parser("gateway")
+    gateway_parser.add_argument("--ini", required=True)
+    gateway_parser.add_argument("--interval", type=int, default=1)
+    gateway_parser.add_argument("--cycles", type=int, default=10)
+    gateway_parser.add_argument("--warmup", type=int, default=1)
+    gateway_parser.add_argument("--write-latency", type=float, default=0.0)
+
+    # record building on its own
+    records_parser = subparsers.add_parser("records")
+    records_parser.add_argument("--devices", type=int, default=100)
+    records_parser.add_argument("--cycles", type=int, default=200)
+    records_parser.add_argument("--layout", default="single", choices=("single", "multi"))
+    records_parser.add_argument("--base-port", type=int, default=48000)
+
+    parser.add_argument("--counts", default="1,10,50,100,200,500",
+                        help="fleet sizes to run, comma separated")
+    parser.add_argument("--device-type", default="dual", choices=("single", "dual"))
+    parser.add_argument("--interval", type=int, default=1, help="gateway interval in seconds")
+    parser.add_argument("--cycles", type=int, default=10, help="cycles measured per fleet size")
+    parser.add_argument("--warmup", type=int, default=1, help="cycles ignored before measuring")
+    parser.add_argument("--write-latency", type=float, default=0.0,
+                        help="seconds each stand-in WriteRecords call takes")
+    parser.add_argument("--mock-processes", type=int, default=2, help="processes hosting the mock fleet")
+    parser.add_argument("--base-port", type=int, default=48000)
+    parser.add_argument("--gateway-port", type=int, default=47999)
+    parser.add_argument("--timeout", type=int, default=900, help="seconds allowed per fleet size")
+    parser.add_argument("--env", action="append", default=[], help="gateway setting NAME=VALUE")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    if args.command == "gateway":
+        gateway(args)
+        return
+    if args.command == "records":
+        records(args)
+        return
+
+    results = []
+    for count in [int(count) for count in args.counts.split(",")]:
+        print("running", count, "devices")
+        result = run_size(args, count)
+        print("    cycle %.3fs mean, %.3fs p95, %.0f reads/s, %.2f cpu s/cycle, %.0f MB" % (
+            result['cycle_mean'], result['cycle_p95'], result['reads_per_second'],
+            result['cpu_per_cycle'], result['max_rss_mb']))
+        results.append(result)
+
+    with open(args.output, "w") as output:
+        json.dump({'started': time.strftime("%Y-%m-%dT%H:%M:%S"), 'results': results}, output, indent=2)
+    print("results written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
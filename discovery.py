@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+"""
+Find the Flexim units on the network and work out what to poll
+
+Who-Is finds the devices, ReadPropertyMultiple reads each one's objectList
+and the objectName of every object, and the points come from the object
+names rather than from fixed instance numbers.  What was found is kept in
+a JSON cache so a restart can go straight to polling.
+"""
+import json
+import os
+import time
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from bacpypes.core import stop
+from bacpypes.iocb import IOCB
+from bacpypes.task import FunctionTask
+from bacpypes.pdu import Address, GlobalBroadcast
+from bacpypes.apdu import WhoIsRequest, ReadPropertyRequest, ReadPropertyMultipleRequest, \
+    ReadAccessSpecification
+from bacpypes.basetypes import PropertyReference
+from bacpypes.primitivedata import CharacterString, Unsigned, ObjectIdentifier
+from bacpypes.constructeddata import ArrayOf
+from bacpypes.app import BIPSimpleApplication
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# objectName requests per ReadPropertyMultiple at most, and fewer when the
+# device's maximum APDU length from its I-Am can't hold the names at about
+# this many bytes each - a request that still fails is split in half, down to
+# ReadProperty for a single name
+NAMES_PER_REQUEST = 20
+NAME_BYTES = 50
+
+# what to poll on each measuring channel, found by the object name after the
+# "chA " or "chB " prefix, with the multi-measure name of each property
+CHANNEL_POINTS = [
+    ("signal amplitude", [('presentValue', 'signal_amplitude', 'DOUBLE')]),
+    ("sound speed", [('presentValue', 'sound_speed', 'DOUBLE')]),
+    ("standard volumetric flow rate", [
+        ('presentValue', 'flow_rate', 'DOUBLE'),
+        ('eventState', 'event_state', 'VARCHAR'),
+        ('reliability', 'reliability', 'VARCHAR'),
+        ('outOfService', 'out_of_service', 'BOOLEAN'),
+        ]),
+    ("SNR", [('presentValue', 'snr', 'DOUBLE')]),
+    ("SCNR", [('presentValue', 'scnr', 'DOUBLE')]),
+    ]
+MEASURING_CHANNELS = ('A', 'B')
+
+ObjectList = ArrayOf(ObjectIdentifier)
+
+#
+#   Discoverer
+#
+@bacpypes_debugging
+class Discoverer(BIPSimpleApplication):
+
+    def __init__(self, targets, wait, *args):
+        """Ask the target addresses, or everyone when there are none, and
+        wait this many seconds for the answers."""
+        if _debug: Discoverer._debug("__init__ %r %r %r", targets, wait, args)
+        BIPSimpleApplication.__init__(self, *args)
+        self.targets = targets
+        self.wait = wait
+
+        # address and maximum APDU length by device instance as the I-Ams
+        # come in
+        self.found = {}
+        self.max_apdu = {}
+
+        # what has been read from each device, by instance, and the devices
+        # that didn't give up all of it
+        self.devices = {}
+        self.pending = 0
+        self.incomplete = set()
+
+        FunctionTask(self.who_is).install_task(when=time.time())
+
+    def who_is(self):
+        if _debug: Discoverer._debug("who_is")
+
+        for target in self.targets or [None]:
+            request = WhoIsRequest()
+            request.pduDestination = Address(target) if target else GlobalBroadcast()
+            self.request(request)
+
+        FunctionTask(self.read_devices).install_task(when=time.time() + self.wait)
+
+    def do_IAmRequest(self, apdu):
+        if _debug: Discoverer._debug("do_IAmRequest %r", apdu)
+        self.found[apdu.iAmDeviceIdentifier[1]] = str(apdu.pduSource)
+        self.max_apdu[apdu.iAmDeviceIdentifier[1]] = apdu.maxAPDULengthAccepted
+
+    def read_devices(self):
+        if _debug: Discoverer._debug("read_devices %r", self.found)
+        print("discovery found", len(self.found), "devices")
+
+        if not self.found:
+            stop()
+            return
+
+        for instance, address in self.found.items():
+            self.devices[instance] = {
+                'address': address,
+                'instance': instance,
+                'databaseRevision': None,
+                'objects': {},
+                }
+
+            # the object list, and the revision that tells when it changes
+            request = ReadPropertyMultipleRequest(listOfReadAccessSpecs=[ReadAccessSpecification(
+                objectIdentifier=('device', instance),
+                listOfPropertyReferences=[PropertyReference(propertyIdentifier='objectList'),
+                                          PropertyReference(propertyIdentifier='databaseRevision')],
+                )])
+            self.send(request, address, self.complete_device, instance)
+
+    def send(self, request, address, callback, *args):
+        request.pduDestination = Address(address)
+        iocb = IOCB(request)
+        iocb.add_callback(callback, *args)
+        self.pending += 1
+        self.request_io(iocb)
+
+    def complete_device(self, iocb, instance):
+        if _debug: Discoverer._debug("complete_device %r %r", iocb, instance)
+        device = self.devices[instance]
+
+        object_list = None
+        if iocb.ioResponse:
+            for element in iocb.ioResponse.listOfReadAccessResults[0].listOfResults:
+                read_result = element.readResult
+                if read_result.propertyAccessError is not None:
+                    continue
+                if element.propertyIdentifier == 'objectList':
+                    object_list = _object_list(read_result.propertyValue)
+                elif element.propertyIdentifier == 'databaseRevision':
+                    device['databaseRevision'] = read_result.propertyValue.cast_out(Unsigned)
+
+        if iocb.ioError:
+            if _debug: Discoverer._debug("    - error: %r", iocb.ioError)
+
+        if object_list is not None:
+            self.read_names(instance, object_list)
+        else:
+            # no ReadPropertyMultiple, or too big for one, try the list on its own
+            request = ReadPropertyRequest(objectIdentifier=('device', instance), propertyIdentifier='objectList')
+            self.send(request, device['address'], self.complete_object_list, instance)
+        self.done()
+
+    def complete_object_list(self, iocb, instance):
+        if _debug: Discoverer._debug("complete_object_list %r %r", iocb, instance)
+
+        if iocb.ioResponse:
+            self.read_names(instance, _object_list(iocb.ioResponse.propertyValue))
+        else:
+            print("discovery could not read the objects of device", instance, iocb.ioError)
+            self.incomplete.add(instance)
+        self.done()
+
+    def read_names(self, instance, object_list):
+        if _debug: Discoverer._debug("read_names %r %r", instance, len(object_list))
+
+        object_list = [obj_id for obj_id in object_list if obj_id[0] != 'device']
+
+        # kept to spot changes on devices without a databaseRevision
+        self.devices[instance]['objectList'] = object_ids(object_list)
+        per_request = max(1, min(NAMES_PER_REQUEST, (self.max_apdu.get(instance) or 480) // NAME_BYTES))
+        for start in range(0, len(object_list), per_request):
+            self.read_name_batch(instance, object_list[start:start + per_request])
+
+    def read_name_batch(self, instance, batch):
+        request = ReadPropertyMultipleRequest(listOfReadAccessSpecs=[ReadAccessSpecification(
+            objectIdentifier=obj_id,
+            listOfPropertyReferences=[PropertyReference(propertyIdentifier='objectName')],
+            ) for obj_id in batch])
+        self.send(request, self.devices[instance]['address'], self.complete_names, instance, batch)
+
+    def complete_names(self, iocb, instance, batch):
+        if _debug: Discoverer._debug("complete_names %r %r %r", iocb, instance, len(batch))
+
+        if iocb.ioResponse:
+            objects = self.devices[instance]['objects']
+            for result in iocb.ioResponse.listOfReadAccessResults:
+                read_result = result.listOfResults[0].readResult
+                if read_result.propertyAccessError is None:
+                    obj_type, obj_instance = result.objectIdentifier
+                    objects["%s:%d" % (obj_type, obj_instance)] = read_result.propertyValue.cast_out(CharacterString)
+        elif len(batch) > 1:
+            # too big for the device, or no ReadPropertyMultiple, try halves
+            if _debug: Discoverer._debug("    - error: %r", iocb.ioError)
+            half = len(batch) // 2
+            self.read_name_batch(instance, batch[:half])
+            self.read_name_batch(instance, batch[half:])
+        else:
+            request = ReadPropertyRequest(objectIdentifier=batch[0], propertyIdentifier='objectName')
+            self.send(request, self.devices[instance]['address'], self.complete_name, instance, batch[0])
+        self.done()
+
+    def complete_name(self, iocb, instance, obj_id):
+        if _debug: Discoverer._debug("complete_name %r %r %r", iocb, instance, obj_id)
+
+        if iocb.ioResponse:
+            self.devices[instance]['objects']["%s:%d" % obj_id] = iocb.ioResponse.propertyValue.cast_out(CharacterString)
+        else:
+            print("discovery could not read the name of", obj_id, "on device", instance, iocb.ioError)
+            self.incomplete.add(instance)
+        self.done()
+
+    def done(self):
+        # everything has answered or given up
+        self.pending -= 1
+        if not self.pending:
+            stop()
+
+
+def _object_list(property_value):
+    # a whole array comes back as a list, without the length in element 0
+    value = property_value.cast_out(ObjectList)
+    return list(value.value[1:]) if hasattr(value, 'value') else list(value)
+
+
+def object_ids(object_list):
+    """The objects other than the device, as the cache keeps them."""
+    return sorted("%s:%d" % (obj_type, obj_instance) for obj_type, obj_instance in object_list
+                  if obj_type != 'device')
+
+
+def read_object_ids(property_value):
+    """The object_ids of an objectList property value."""
+    return object_ids(_object_list(property_value))
+
+
+def load_cache(path, targets):
+    """The devices from the cache, or None when it is missing or was made
+    for different targets."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as cache_file:
+        cache = json.load(cache_file)
+    if cache.get('targets') != targets:
+        print("discovery targets changed")
+        return None
+    return cache['devices']
+
+
+def save_cache(path, targets, devices):
+    with open(path + ".tmp", "w") as cache_file:
+        json.dump({'targets': targets, 'time': time.time(), 'devices': devices}, cache_file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def build_points(devices):
+    """Return the point list and the multi-measure names for the devices."""
+    points = []
+    measures = {}
+    for device in devices:
+        by_name = {name: obj_id for obj_id, name in device['objects'].items()}
+        bacnet_ref = str(device['instance'])
+
+        channels = [channel for channel in MEASURING_CHANNELS
+                    if any(name.startswith("ch%s " % channel) for name in by_name)]
+        if not channels:
+            print("discovery found no flow channels on device", device['instance'])
+
+        for channel in channels:
+            for name, properties in CHANNEL_POINTS:
+                obj_id = by_name.get("ch%s %s" % (channel, name))
+                if obj_id is None:
+                    print("discovery found no", repr(name), "on channel", channel, "of device", device['instance'])
+                    continue
+                for prop_id, measure, measure_type in properties:
+                    points.append((device['address'], obj_id, prop_id, bacnet_ref))
+                    measures[(obj_id, prop_id)] = (channel, measure, measure_type)
+
+    return points, measures
@@ -7,48 +7,305 @@ Based on BACpypes with AWS connector
 
 IP addresses - site dependent
 """
+import argparse
+import atexit
 import logging
+import sys
 import time
 import os
-import boto3
+import heapq
+import math
+import json
+import random
+import threading
+import multiprocessing
+import socket
+import subprocess
+from multiprocessing.connection import wait
 from dotenv import load_dotenv
-from botocore.config import Config
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
-from bacpypes.core import run, deferred
+from bacpypes.core import run, stop, deferred
 from bacpypes.iocb import IOCB
-from bacpypes.task import RecurringTask
+from bacpypes.task import OneShotTask, FunctionTask
 from bacpypes.pdu import Address
 from bacpypes.object import get_datatype
-from bacpypes.apdu import ReadPropertyRequest
-from bacpypes.primitivedata import Unsigned, ObjectIdentifier
+from bacpypes.apdu import ReadPropertyRequest, ReadPropertyMultipleRequest, \
+    ReadAccessSpecification, SubscribeCOVRequest, RejectPDU, RejectReason, AbortPDU
+from bacpypes.basetypes import PropertyReference
+from bacpypes.primitivedata import Unsigned, Real, ObjectIdentifier
 from bacpypes.constructeddata import Array
 from bacpypes.app import BIPSimpleApplication
+from bacpypes.appservice import AWAIT_CONFIRMATION
 from bacpypes.local.device import LocalDeviceObject
+from bacpypes.settings import Settings
+from sinks import Sink, FileSink, InfluxSink, MqttSink
+from ratelimit import TokenBucket, AdaptiveLimit
+from aggregate import Aggregator
+from archive import Archive
+from discovery import Discoverer, load_cache, save_cache, build_points, read_object_ids
+import metrics
 load_dotenv()
 
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
-# create a new boto3 session with timestream
-session = boto3.Session()
-client = session.client('timestream-write',region_name="us-east-2",aws_access_key_id=os.getenv("ACCESS_KEY"),aws_secret_access_key=os.getenv("SECRET_KEY"),config=Config(read_timeout=20, max_pool_connections=5000,retries={'max_attempts': 10}))
+# for the time to first reading
+process_start = time.monotonic()
+
+# the timestream client, made by get_client() on the first upload because
+# importing boto3 takes seconds on a Pi
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+
+    with client_lock:
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            # create a new boto3 session with timestream
+            session = boto3.Session()
+            # one connection per call that can be in flight, and no retries of
+            # its own, _write_chunk backs off and retries throttled calls and
+            # transient errors itself
+            client = session.client('timestream-write',region_name="us-east-2",aws_access_key_id=os.getenv("ACCESS_KEY"),aws_secret_access_key=os.getenv("SECRET_KEY"),config=Config(read_timeout=20, max_pool_connections=write_threads,retries={'total_max_attempts': 1}))
+    return client
+
+# WriteRecords takes at most 100 records a call, the chunks of a cycle are
+# sent in parallel
+MAX_RECORDS_PER_WRITE = 100
+write_threads = int(os.getenv("WRITE_THREADS", "4"))
+write_pool = ThreadPoolExecutor(max_workers=write_threads)
+
+# at most WRITE_RATE records a second (bursts of WRITE_BURST), 0 for no limit,
+# and between WRITE_THREADS_MIN and WRITE_THREADS calls in flight, halved when
+# Timestream throttles and back up by one call after each round of successes -
+# a throttled call is tried again up to WRITE_ATTEMPTS times in all, after a
+# random wait of up to WRITE_BACKOFF seconds, doubling each time up to
+# WRITE_BACKOFF_MAX, so the gateways at a site don't all retry together
+write_rate = float(os.getenv("WRITE_RATE", "0"))
+write_burst = float(os.getenv("WRITE_BURST", str(max(write_rate, MAX_RECORDS_PER_WRITE))))
+write_threads_min = int(os.getenv("WRITE_THREADS_MIN", "1"))
+write_attempts = int(os.getenv("WRITE_ATTEMPTS", "5"))
+write_backoff = float(os.getenv("WRITE_BACKOFF", "0.5"))
+write_backoff_max = float(os.getenv("WRITE_BACKOFF_MAX", "20"))
+# records Timestream rejected for good are appended to this file as JSON lines,
+# moved aside to the same name with .1 appended when it gets this big
+dead_letter_path = os.getenv("DEAD_LETTER_PATH", "dead_letter.jsonl")
+dead_letter_max_bytes = int(os.getenv("DEAD_LETTER_MAX_MB", "10")) * 1024 * 1024
+dead_letter_lock = threading.Lock()
+write_bucket = TokenBucket(write_rate, write_burst)
+write_limit = AdaptiveLimit(write_threads_min, write_threads)
+# cycles waiting for each sink, when one falls this far behind its oldest
+# waiting cycle is dropped to make room for the newest
+upload_queue_size = int(os.getenv("UPLOAD_QUEUE_SIZE", "60"))
+# with a spool path set every cycle is committed to disk before it is sent and
+# whatever built up during an outage is sent in batches of spool_drain_records,
+# sinks other than timestream spool to the same path with their name appended
+spool_path = os.getenv("SPOOL_PATH")
+spool_max_bytes = int(os.getenv("SPOOL_MAX_MB", "100")) * 1024 * 1024
+spool_drain_records = int(os.getenv("SPOOL_DRAIN_RECORDS", "2000"))
+
+# where the records go, any of timestream, file, influx and mqtt at once -
+# each sink writes batches of up to <SINK>_BATCH_RECORDS records, waiting up
+# to <SINK>_BATCH_SECONDS for a batch to fill
+sink_names = [name.strip() for name in os.getenv("SINKS", "timestream").split(",") if name.strip()]
+file_sink_path = os.getenv("FILE_SINK_PATH", "records")
+influx_url = os.getenv("INFLUX_URL", "http://127.0.0.1:8086")
+influx_org = os.getenv("INFLUX_ORG", "")
+influx_bucket = os.getenv("INFLUX_BUCKET", "flexim")
+influx_token = os.getenv("INFLUX_TOKEN")
+mqtt_host = os.getenv("MQTT_HOST", "127.0.0.1")
+mqtt_port = int(os.getenv("MQTT_PORT", "1883"))
+mqtt_topic = os.getenv("MQTT_TOPIC", "flexim")
+mqtt_username = os.getenv("MQTT_USERNAME")
+mqtt_password = os.getenv("MQTT_PASSWORD")
+mqtt_qos = int(os.getenv("MQTT_QOS", "1"))
 # the IP addresses of the targets - local IP is stored within BACpypes.ini file
 ip_addresses = []
-ip_addresses.extend(os.getenv("IP_ADDRESSES").split(","))
+ip_addresses.extend(filter(None, os.getenv("IP_ADDRESSES", "").split(",")))
 # the BACnet addresses of the targets
 bacnet_addresses = []
-bacnet_addresses.extend(os.getenv("BACNET_ADDRESSES").split(","))
+bacnet_addresses.extend(filter(None, os.getenv("BACNET_ADDRESSES", "").split(",")))
 #is each target dual or single channel
 device_types = []
-device_types.extend(os.getenv("DEVICE_TYPES").split(","))
+device_types.extend(filter(None, os.getenv("DEVICE_TYPES", "").split(",")))
+
+# find the devices and their points instead of using the lists above, asking
+# the IP addresses if there are any or everyone if not, and remembering what
+# was found in the cache until the targets change, a device's object database
+# revision changes (checked every DISCOVERY_CHECK seconds, the object list
+# itself for devices without one) or --rediscover - when nothing answers it
+# tries again after DISCOVERY_RETRY seconds, doubling up to DISCOVERY_RETRY_MAX,
+# and when only some of the targets answer, or not all of their objects could
+# be read, it polls what it has and rediscovers on the same backoff
+discovery = os.getenv("DISCOVERY", "false") == "true"
+discovery_cache = os.getenv("DISCOVERY_CACHE", "discovery.json")
+discovery_wait = float(os.getenv("DISCOVERY_WAIT", "5"))
+discovery_check = float(os.getenv("DISCOVERY_CHECK", "3600"))
+discovery_retry = float(os.getenv("DISCOVERY_RETRY", "10"))
+discovery_retry_max = float(os.getenv("DISCOVERY_RETRY_MAX", "600"))
+# the longest a restart for discovery waits for the sinks to write, or spool,
+# what has been read
+RESTART_FLUSH_SECONDS = 30
+# how a worker tells the supervisor to start again with a fresh discovery
+REDISCOVER_EXIT = 3
+# "single" sends one ReadProperty per point, "multiple" sends one
+# ReadPropertyMultiple per device and falls back to single reads for devices
+# that reject it
+read_mode = os.getenv("READ_MODE", "single")
+
+# how many requests may be outstanding at once, in total and per device -
+# bacpypes queues requests to the same address, so a per-device limit of 2
+# just keeps the next one waiting there instead of in our own queue
+max_in_flight = int(os.getenv("MAX_IN_FLIGHT", "1"))
+device_in_flight = int(os.getenv("DEVICE_IN_FLIGHT", "1"))
+
+# subscribe to COV for every presentValue point and only poll the rest, plus
+# any device that refuses, renewing the subscriptions half way through their
+# lifetime in seconds
+subscribe_cov = os.getenv("SUBSCRIBE_COV", "false") == "true"
+cov_lifetime = int(os.getenv("COV_LIFETIME", "300"))
+cov_process_id = int(os.getenv("COV_PROCESS_ID", "1"))
+
+# polling period in seconds for a property, an object or an object/property,
+# e.g. "eventState=300,analogInput:121=30", anything not listed is read every
+# interval
+poll_periods = {}
+for entry in filter(None, os.getenv("POLL_PERIODS", "").split(",")):
+    key, period = entry.split("=")
+    poll_periods[key.strip()] = float(period)
+
+# only upload analog values that moved by at least their deadband and other
+# values that changed, but every series at least once a heartbeat in seconds -
+# deadbands are set like the polling periods and otherwise come from the
+# object's covIncrement
+report_by_exception = os.getenv("REPORT_BY_EXCEPTION", "false") == "true"
+heartbeat = float(os.getenv("HEARTBEAT", "900"))
+deadbands = {}
+for entry in filter(None, os.getenv("DEADBANDS", "").split(",")):
+    key, deadband = entry.split("=")
+    deadbands[key.strip()] = float(deadband)
+
+# "single" uploads one record per point, "multi" folds the points of each
+# flow channel into one multi-measure record using MULTI_MEASURES
+record_layout = os.getenv("RECORD_LAYOUT", "single")
+
+# BACnet object and property to channel, measure name and type for the
+# multi-measure layout, points not listed keep their own record
+MULTI_MEASURES = {
+    ('analogInput:105', 'presentValue'): ('A', 'signal_amplitude', 'DOUBLE'),
+    ('analogInput:106', 'presentValue'): ('A', 'sound_speed', 'DOUBLE'),
+    ('analogInput:111', 'presentValue'): ('A', 'flow_rate', 'DOUBLE'),
+    ('analogInput:111', 'eventState'): ('A', 'event_state', 'VARCHAR'),
+    ('analogInput:111', 'reliability'): ('A', 'reliability', 'VARCHAR'),
+    ('analogInput:111', 'outOfService'): ('A', 'out_of_service', 'BOOLEAN'),
+    ('analogInput:121', 'presentValue'): ('A', 'snr', 'DOUBLE'),
+    ('analogInput:122', 'presentValue'): ('A', 'scnr', 'DOUBLE'),
+    ('analogInput:205', 'presentValue'): ('B', 'signal_amplitude', 'DOUBLE'),
+    ('analogInput:206', 'presentValue'): ('B', 'sound_speed', 'DOUBLE'),
+    ('analogInput:211', 'presentValue'): ('B', 'flow_rate', 'DOUBLE'),
+    ('analogInput:211', 'eventState'): ('B', 'event_state', 'VARCHAR'),
+    ('analogInput:211', 'reliability'): ('B', 'reliability', 'VARCHAR'),
+    ('analogInput:211', 'outOfService'): ('B', 'out_of_service', 'BOOLEAN'),
+    ('analogInput:221', 'presentValue'): ('B', 'snr', 'DOUBLE'),
+    ('analogInput:222', 'presentValue'): ('B', 'scnr', 'DOUBLE'),
+    }
+multi_measures = dict(MULTI_MEASURES) if record_layout == "multi" else {}
+
+# numbers are polled as usual but only their min, max, mean, last and count
+# over each window of this many seconds are uploaded, 0 uploads every sample
+aggregate_window = int(os.getenv("AGGREGATE_WINDOW", "0"))
+
+# every raw reading is also kept on the gateway in hourly files in this
+# directory, for this many hours
+archive_path = os.getenv("ARCHIVE_PATH")
+archive_retention_hours = int(os.getenv("ARCHIVE_RETENTION_HOURS", "720"))
+
+# each device gets a deadline for each try of a read from its smoothed round
+# trip time, between these limits in seconds - the floor is there because an
+# embedded BACnet stack jitters by a few hundred milliseconds however fast it
+# usually is - a read is given up after the local device's APDU retries, and
+# after this many of those in a row a device is skipped, then probed again
+# after a backoff that doubles up to the maximum
+timeout_min = float(os.getenv("TIMEOUT_MIN", "1"))
+timeout_max = float(os.getenv("TIMEOUT_MAX", "3"))
+breaker_failures = int(os.getenv("BREAKER_FAILURES", "3"))
+breaker_backoff = float(os.getenv("BREAKER_BACKOFF", "10"))
+breaker_backoff_max = float(os.getenv("BREAKER_BACKOFF_MAX", "600"))
+
+# serve the metrics below in Prometheus text format on this port
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# split the devices over this many polling processes, each on its own port
+# counting up from WORKER_PORT and with its own device instance counting up
+# from the ini file's, all feeding the uploader in the supervisor
+workers = int(os.getenv("WORKERS", "1"))
+worker_port = int(os.getenv("WORKER_PORT", "47809"))
+
+# cycles start on multiples of the interval of wall clock time, e.g. at :00,
+# :10, :20 for 10 s, kept in step with the monotonic clock, or counted from
+# startup when ALIGN_CYCLES is off - a tick that comes while the last cycle
+# is still running is dropped ("skip"), starts a cycle as soon as that one
+# finishes ("stretch"), or is kept, up to CATCHUP_MAX of them, and each run
+# back to back afterwards ("catchup")
+align_cycles = os.getenv("ALIGN_CYCLES", "true") == "true"
+overrun_policy = os.getenv("OVERRUN_POLICY", "skip")
+catchup_max = int(os.getenv("CATCHUP_MAX", "3"))
+if overrun_policy not in ("skip", "stretch", "catchup"):
+    raise ValueError("unknown overrun policy: %r" % (overrun_policy,))
+# the wall clock moving this many seconds against the monotonic clock, as when
+# ntpd steps it, realigns the cycles
+CLOCK_STEP = 0.5
+
+# startup waits up to this many seconds for the local address to be up and
+# the BACnet port to be free, then steps the clock with ntpd alongside polling
+# when NTP_SYNC is on - cycles finished before the clock is right are not
+# uploaded
+startup_timeout = float(os.getenv("STARTUP_TIMEOUT", "120"))
+ntp_sync = os.getenv("NTP_SYNC", "true") == "true"
+clock_synced = threading.Event()
+
+cycle_seconds = metrics.Histogram("flexim_cycle_seconds", "Time to read the points due in a cycle")
+overrun_ticks = metrics.Counter("flexim_overrun_ticks_total", "Ticks that came while the last cycle was still running")
+skipped_ticks = metrics.Counter("flexim_skipped_ticks_total", "Ticks skipped because the last cycle was still running")
+late_cycles = metrics.Counter("flexim_late_cycles_total", "Cycles started late for ticks that came while the last one was running")
+clock_steps = metrics.Counter("flexim_clock_steps_total", "Times the wall clock jumped and the cycles were realigned")
+device_read_seconds = metrics.Histogram("flexim_device_read_seconds", "Round trip time of reads by device")
+point_read_seconds = metrics.Histogram("flexim_point_read_seconds", "Round trip time of reads by point")
+bacnet_errors = metrics.Counter("flexim_bacnet_errors_total", "BACnet errors by type")
+cycle_records = metrics.Gauge("flexim_cycle_records", "Records built by the last cycle")
+records_built = metrics.Counter("flexim_records_built_total", "Records built")
+write_seconds = metrics.Histogram("flexim_write_seconds", "Time taken by WriteRecords calls")
+write_throttles = metrics.Counter("flexim_write_throttles_total", "WriteRecords calls throttled")
+write_rejected = metrics.Counter("flexim_write_rejected_records_total", "Records rejected by WriteRecords by what was done with them")
+dead_letters = metrics.Counter("flexim_dead_letter_records_total", "Records written to the dead letter file")
+write_errors = metrics.Counter("flexim_write_errors_total", "WriteRecords calls that failed")
+write_concurrency = metrics.Gauge("flexim_write_concurrency_limit", "WriteRecords calls allowed in flight", function=lambda: write_limit.limit)
+first_reading_seconds = metrics.Gauge("flexim_first_reading_seconds", "Time from starting up to the first readings")
+unsynced_cycles = metrics.Counter("flexim_unsynced_cycles_total", "Cycles not uploaded because the clock was not yet synchronised")
+
+# rejection reasons worth sending again unchanged, in lower case
+RETRYABLE_REJECTIONS = ("internal", "throttl", "try again", "timed out")
+# the largest Version a record can have
+MAX_RECORD_VERSION = 2 ** 63 - 1
+
+# abort reasons that mean a device can't answer a ReadPropertyMultiple in one go
+RPM_FALLBACK_ABORTS = ('segmentationNotSupported', 'bufferOverflow', 'apduTooLong')
 
 # point list
 point_list = []
 
-for x in range(len(ip_addresses)):
+# discovery builds its own after startup
+for x in range(0 if discovery else len(ip_addresses)):
     point_list.extend([
     #ChA Signal Amplitude
     (ip_addresses[x], 'analogInput:105', 'presentValue', bacnet_addresses[x]),
@@ -80,23 +337,247 @@ for x in range(len(ip_addresses)):
         #ChB SCNR
         (ip_addresses[x], 'analogInput:222', 'presentValue', bacnet_addresses[x])
         ])
-    
+
+#
+#   Point table
+#
+class Point:
+
+    __slots__ = ('addr', 'obj_id', 'prop_id', 'bacnet_ref', 'address',
+                 'object_identifier', 'datatype', 'value_type', 'measure', 'period',
+                 'deadband', 'template', 'channel_key', 'channel_template')
+
+    def __init__(self, addr, obj_id, prop_id, bacnet_ref, address):
+        self.addr = addr
+        self.obj_id = obj_id
+        self.prop_id = prop_id
+        self.bacnet_ref = bacnet_ref
+        self.address = address
+
+        # parsed and looked up once rather than on every read
+        self.object_identifier = ObjectIdentifier(obj_id).value
+        self.datatype = get_datatype(self.object_identifier[0], prop_id)
+        if not self.datatype:
+            raise TypeError("unknown datatype for %s %s" % (obj_id, prop_id))
+        if (prop_id=="presentValue") or (prop_id=="covIncrement"):
+            self.value_type = "DOUBLE"
+        else:
+            self.value_type = "VARCHAR"
+        self.measure = multi_measures.get((obj_id, prop_id))
+
+        # the parts of its record that never change, copied for each value -
+        # a measure of a multi-measure record shares the channel's template
+        if self.measure:
+            self.template = {'Name': self.measure[1], 'Value': None, 'Type': self.measure[2]}
+            self.channel_key = (bacnet_ref, self.measure[0])
+        else:
+            self.template = {
+                'Time': None,
+                'Dimensions': [{'Name': 'tag', 'Value': bacnet_ref},
+                               {'Name': 'BACnet_ref', 'Value': obj_id}],
+                'MeasureName': prop_id,
+                'MeasureValue': None,
+                'MeasureValueType': self.value_type,
+                }
+            self.channel_key = None
+        self.channel_template = None
+
+        # the most specific setting wins, a zero period is every interval and
+        # a missing deadband comes from covIncrement
+        self.period = _point_setting(poll_periods, obj_id, prop_id, 0)
+        self.deadband = _point_setting(deadbands, obj_id, prop_id, None)
+
+    def __repr__(self):
+        return "<Point %s %s %s>" % (self.addr, self.obj_id, self.prop_id)
+
+
+class Device:
+
+    __slots__ = ('addr', 'address', 'points', 'index', 'read_access_specs',
+                 'srtt', 'rttvar', 'failures', 'backoff', 'open_until')
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.address = Address(addr)
+
+        # points in list order, the same keyed by (object identifier,
+        # property) for matching replies, and the read access specifications
+        # asking for all of them
+        self.points = []
+        self.index = {}
+        self.read_access_specs = None
+
+        # round trip time tracking and the circuit breaker
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.backoff = breaker_backoff
+        self.open_until = 0
+
+    def __repr__(self):
+        return "<Device %s>" % (self.addr,)
+
+    @property
+    def timeout(self):
+        # nothing to go on yet
+        if self.srtt is None:
+            return timeout_max
+        return min(max(self.srtt + 4 * self.rttvar, timeout_min), timeout_max)
+
+    def success(self, rtt):
+        # smoothed round trip time and its variation, the way TCP does it
+        if rtt is None:
+            pass
+        elif self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        # answering again closes the breaker
+        if self.failures >= breaker_failures:
+            print("Device", self.addr, "answering again")
+        self.failures = 0
+        self.backoff = breaker_backoff
+        self.open_until = 0
+
+    def failure(self):
+        self.failures += 1
+
+        # open, or stay open for longer after a failed probe
+        if self.failures >= breaker_failures:
+            print("Device", self.addr, "not answering, skipping it for", self.backoff, "seconds")
+            self.open_until = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, breaker_backoff_max)
+
+
+def _point_setting(settings, obj_id, prop_id, default):
+    return settings.get(obj_id + "/" + prop_id, settings.get(obj_id, settings.get(prop_id, default)))
+
+
+def compile_points(points):
+    # turn the point list into a point table and the devices it covers
+    table = []
+    devices = {}
+    channel_templates = {}
+    for addr, obj_id, prop_id, bacnet_ref in points:
+        device = devices.get(addr)
+        if device is None:
+            device = devices[addr] = Device(addr)
+        point = Point(addr, obj_id, prop_id, bacnet_ref, device.address)
+        if point.channel_key:
+            point.channel_template = channel_templates.get(point.channel_key)
+            if point.channel_template is None:
+                point.channel_template = channel_templates[point.channel_key] = {
+                    'Time': None,
+                    'Dimensions': [{'Name': 'tag', 'Value': bacnet_ref},
+                                   {'Name': 'channel', 'Value': point.measure[0]}],
+                    'MeasureName': 'flow_channel',
+                    'MeasureValues': None,
+                    'MeasureValueType': 'MULTI',
+                    }
+        device.points.append(point)
+        device.index[(point.object_identifier, prop_id)] = point
+        table.append(point)
+
+    for device in devices.values():
+        device.read_access_specs = _read_access_specs(device.points)
+
+    return table, devices
+
+
+def _read_access_specs(points):
+    # one read access specification per object, keeping the point order
+    properties = {}
+    for point in points:
+        properties.setdefault(point.object_identifier, []).append(point.prop_id)
+
+    read_access_specs = []
+    for obj_id, prop_ids in properties.items():
+        read_access_specs.append(ReadAccessSpecification(
+            objectIdentifier=obj_id,
+            listOfPropertyReferences=[PropertyReference(propertyIdentifier=prop_id) for prop_id in prop_ids],
+            ))
+    return read_access_specs
+
+
+# compile once at startup
+point_table, devices = compile_points(point_list)
+
+# (device instance, object database revision) by address, when the points
+# were discovered
+database_revisions = {}
+# (device instance, object ids) by address for devices without a revision
+object_lists = {}
+# seconds until discovery is tried again when some targets didn't answer,
+# None when everything was found
+discovery_backoff = None
+
+
+def discover_points(ini, rediscover, backoff=None):
+    global point_list, point_table, devices, discovery_backoff
+
+    # the cache unless asked not to or it is out of date
+    found = None if rediscover else load_cache(discovery_cache, ip_addresses)
+    backoff = backoff or discovery_retry
+    while found is None:
+        print("discovering devices")
+        discoverer = Discoverer(ip_addresses, discovery_wait, LocalDeviceObject(ini=ini), ini.address)
+        run()
+        discoverer.close_socket()
+        found = list(discoverer.devices.values())
+
+        # meters can take a while to come back after a power cut
+        if not found:
+            print("discovery found nothing, trying again in", backoff, "seconds")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, discovery_retry_max)
+            found = None
+        elif len(found) < len(ip_addresses):
+            print("discovery found", len(found), "of", len(ip_addresses), "devices, trying again in", backoff, "seconds")
+            discovery_backoff = backoff
+        elif discoverer.incomplete:
+            print("discovery could not read all the objects of", len(discoverer.incomplete), "devices, trying again in", backoff, "seconds")
+            discovery_backoff = backoff
+        else:
+            save_cache(discovery_cache, ip_addresses, found)
+
+    point_list, measures = build_points(found)
+    if record_layout == "multi":
+        multi_measures.update(measures)
+    point_table, devices = compile_points(point_list)
+
+    for device in found:
+        if device['databaseRevision'] is not None:
+            database_revisions[device['address']] = (device['instance'], device['databaseRevision'])
+        else:
+            print("device", device['instance'], "has no databaseRevision, checking its objectList for changes")
+            object_lists[device['address']] = (device['instance'], device.get('objectList', sorted(device['objects'])))
+    print("polling", len(point_table), "points on", len(devices), "devices")
+
 #
 #   PrairieDog
 #
 @bacpypes_debugging
-class PrairieDog(BIPSimpleApplication, RecurringTask):
+class PrairieDog(BIPSimpleApplication, OneShotTask):
 
-    def __init__(self, interval, *args):
+    def __init__(self, interval, *args, uploader=None):
         if _debug: PrairieDog._debug("__init__ %r %r", interval, args)
         BIPSimpleApplication.__init__(self, *args)
-        RecurringTask.__init__(self, interval * 1000)
+        OneShotTask.__init__(self)
+        self.interval = interval
 
         # no longer busy
         self.is_busy = False
 
+        # ticks kept for after an overrun
+        self.backlog = 0
+
         # install the task
-        self.install_task()
+        self.align()
+        self.schedule_tick()
+        threading.Thread(target=self.watch_clock, name="clock", daemon=True).start()
 
         # boolean allowing two batches per AWS transmission, if you want to batch
         # AWS use a 1KB write size so this is worth doing if ingestion is less than 500B
@@ -105,84 +586,507 @@ class PrairieDog(BIPSimpleApplication, RecurringTask):
         #array to store Records
         self.records = []
 
+        # uploads run on their own thread so a slow uplink can't hold up polling,
+        # workers hand theirs to the supervisor instead
+        if uploader is None:
+            uploader = Uploader(upload_queue_size)
+            uploader.start()
+        self.uploader = uploader
+
+        # devices that have refused a ReadPropertyMultiple
+        self.single_read_devices = set()
+
+        # heap of (due time, index, point) on the monotonic clock so a stepped
+        # wall clock doesn't move them, everything is due on the first cycle
+        now = time.monotonic()
+        self.schedule = [(now, index, point) for index, point in enumerate(point_table)]
+        heapq.heapify(self.schedule)
+
+        # the last value and time uploaded for each point
+        self.last_reported = {}
+        self.deadbands_requested = False
+
+        # presentValue points keyed by (device address, object identifier),
+        # the points the devices have accepted a subscription for, and the
+        # values notified since the last cycle
+        self.cov_points = {}
+        if subscribe_cov:
+            for point in point_table:
+                if point.prop_id == "presentValue":
+                    self.cov_points[(point.address, point.object_identifier)] = point
+        self.cov_active = set()
+        self.cov_refused_devices = set()
+        self.cov_values = {}
+        self.cov_times = {}
+        self.cov_renew_time = 0
+
+        # a slot for each numeric point, and the start of the current window
+        self.aggregate_points = [point for point in point_table if point.value_type == "DOUBLE"]
+        self.aggregate_slots = {point: slot for slot, point in enumerate(self.aggregate_points)}
+        self.aggregator = Aggregator(len(self.aggregate_points)) if aggregate_window else None
+        self.window_start = time.time() // aggregate_window * aggregate_window if aggregate_window else 0
+
+        self.first_reading = None
+
+        # discovered devices are checked for changes now and then, and
+        # discovery tried again when some of them didn't answer
+        self.revision_check_time = time.monotonic() + discovery_check
+        self.rediscover = False
+        if discovery_backoff:
+            self.discovery_retry_time = time.monotonic() + discovery_backoff
+
+        # what is still buffered goes to disk when the gateway stops
+        self.archive = None
+        if archive_path:
+            self.archive = Archive(archive_path, archive_retention_hours, _error_type)
+            atexit.register(self.archive.flush)
+
+    def align(self):
+        if _debug: PrairieDog._debug("align")
+
+        # tick 0 on the next boundary, or now, in monotonic time
+        wall, now = time.time(), time.monotonic()
+        self.clock_offset = wall - now
+        first = math.ceil(wall / self.interval) * self.interval if align_cycles else wall
+        self.tick_origin = now + (first - wall)
+        self.tick = 0
+
+    def schedule_tick(self):
+        # the monotonic clock keeps the ticks apart, a stepped wall clock moves
+        # the boundaries they should be on
+        if abs(time.time() - time.monotonic() - self.clock_offset) > CLOCK_STEP:
+            print("clock stepped, realigning cycles" if align_cycles else "clock stepped")
+            clock_steps.inc()
+            if align_cycles:
+                self.align()
+            else:
+                self.clock_offset = time.time() - time.monotonic()
+
+        # counted from tick 0 so there is no drift to build up
+        due = self.tick_origin + self.tick * self.interval
+        self.install_task(when=time.time() + max(0.0, due - time.monotonic()))
+
+    def watch_clock(self):
+        # the task manager keeps time with the wall clock, so a step back puts
+        # off the pending tick by as much; its own tasks would be put off
+        # too, so a thread sleeping on the monotonic clock looks for steps
+        # and has the tick scheduled again
+        offset = self.clock_offset
+        while True:
+            time.sleep(1)
+            if abs(time.time() - time.monotonic() - offset) > CLOCK_STEP:
+                offset = time.time() - time.monotonic()
+                deferred(self.schedule_tick)
+
     def process_task(self):
-        if _debug: PrairieDog._debug("process_task")
-        global point_list
+        if _debug: PrairieDog._debug("process_task %r", self.tick)
+
+        # the next one is due on its boundary whatever happens to this one
+        self.tick += 1
+        self.schedule_tick()
 
         # check to see if we're idle
         if self.is_busy:
             if _debug: PrairieDog._debug("    - busy")
+            overrun_ticks.inc()
+            if (overrun_policy == "stretch") and not self.backlog:
+                self.backlog = 1
+            elif (overrun_policy == "catchup") and (self.backlog < catchup_max):
+                self.backlog += 1
+            else:
+                skipped_ticks.inc()
             return
 
+        self.start_cycle()
+
+    def start_cycle(self):
+        if _debug: PrairieDog._debug("start_cycle")
+
         # now we are busy
         self.is_busy = True
+        self.cycle_start = time.monotonic()
 
-        # turn the point list into a queue
-        self.point_queue = deque(point_list)
+        # fill in deadbands from covIncrement the first time round
+        if report_by_exception and not self.deadbands_requested:
+            self.request_deadbands()
 
-        # clean out the list of the response values
-        self.response_values = []
+        # see if any device's objects have changed since they were discovered
+        if (database_revisions or object_lists) and discovery_check and (time.monotonic() >= self.revision_check_time):
+            self.check_revisions()
+        if discovery_backoff and (time.monotonic() >= self.discovery_retry_time) and not self.rediscover:
+            print("rediscovering the devices that didn't answer")
+            self.rediscover = True
+            stop()
+
+        # (re)subscribe when the subscriptions are half way through their life
+        if self.cov_points and (time.monotonic() >= self.cov_renew_time):
+            self.subscribe_cov()
+
+        # turn the points that are due into a queue of batches per device,
+        # one point per batch unless each device's points are read together,
+        # leaving out points with a live subscription
+        due_points = self.due_points()
+        self.point_queues = {}
+        now = time.monotonic()
+        for addr, points in due_points.items():
+            # skip devices that stopped answering until it is time to probe them
+            if devices[addr].open_until > now:
+                continue
+            if self.cov_active:
+                points = [point for point in points if point not in self.cov_active]
+                if not points:
+                    continue
+            if read_mode == "multiple":
+                self.point_queues[addr] = deque([points])
+            else:
+                self.point_queues[addr] = deque([point] for point in points)
+
+        # devices with queued batches and room for another request, taken in turn
+        self.ready_devices = deque(self.point_queues)
+        self.device_in_flight = dict.fromkeys(self.point_queues, 0)
+        self.in_flight = 0
+
+        # clean out the response values and the times they came in, keyed by point
+        self.response_values = {}
+        self.sample_times = {}
 
         # fire off the next request
         self.next_request()
 
+    def due_points(self):
+        if _debug: PrairieDog._debug("due_points")
+
+        # anything due before the middle of the next interval is read now
+        now = time.monotonic()
+        horizon = now + self.interval / 2
+
+        due = {}
+        while self.schedule and (self.schedule[0][0] <= horizon):
+            due_time, index, point = self.schedule[0]
+            due.setdefault(point.addr, []).append(point)
+
+            # next time round, skipping any that were missed unless they
+            # are to be caught up
+            period = max(point.period, self.interval)
+            due_time += period
+            oldest = horizon - catchup_max * period if overrun_policy == "catchup" else horizon
+            if due_time <= oldest:
+                due_time += (math.floor((oldest - due_time) / period) + 1) * period
+            heapq.heapreplace(self.schedule, (due_time, index, point))
+
+        # a device with everything due can use its prebuilt request
+        for addr, points in due.items():
+            if len(points) == len(devices[addr].points):
+                due[addr] = devices[addr].points
+
+        return due
+
     def next_request(self):
         if _debug: PrairieDog._debug("next_request")
 
-        # check to see if we're done
-        if not self.point_queue:
-            if _debug: PrairieDog._debug("    - done")
-
-            #if self.batchToggle == False:
-                #print("records reset")
-            self.records = []
-
-            currentTime = str(int(round(time.time()*1000)))
-
-            # dump out the results
-            for request, response in zip(point_list, self.response_values):
-                valueType = ""
-                if (request[2]=="presentValue") or (request[2]=="covIncrement"):
-                    valueType = "DOUBLE"
-                else:
-                    valueType = "VARCHAR"
-                self.records.append({
-                    'Time': currentTime,
-                    'Dimensions': [{'Name': 'tag', 'Value': request[3]},
-                                   {'Name': 'BACnet_ref', 'Value': request[1]}],
-                    'MeasureName': request[2],
-                    'MeasureValue': str(response),
-                    'MeasureValueType': valueType,
-                    })
-
-            # for batching applications only
-            #self.batchToggle = not self.batchToggle
-            #if self.batchToggle == False:
-            
-            # replace with correct database and table names
-            try:
-                result = client.write_records(DatabaseName=os.getenv("DATABASE"), TableName=os.getenv("TABLE"), Records=self.records)
-                #print("WriteRecords Status: [%s]" % result['ResponseMetadata']['HTTPStatusCode'])
-            except client.exceptions.RejectedRecordsException as err:
-                _print_rejected_recrods_Exceptions(err)
-            except Exception as err:
-                print("Error:",err)
+        # a late callback from a cycle that has already finished
+        if not self.is_busy:
+            return
+
+        # fill the window
+        while self.ready_devices and (self.in_flight < max_in_flight):
+            addr = self.ready_devices.popleft()
+            queue = self.point_queues[addr]
+
+            # stale entry, the device emptied or filled up since it was added
+            if not queue or (self.device_in_flight[addr] >= device_in_flight):
+                continue
+            batch = queue.popleft()
+
+            # devices that refused a batch get their points one at a time
+            if (len(batch) > 1) and (addr in self.single_read_devices):
+                queue.extendleft([point] for point in reversed(batch))
+                batch = queue.popleft()
+
+            self.in_flight += 1
+            self.device_in_flight[addr] += 1
+
+            # back of the line if there is more to read from this device
+            if queue and (self.device_in_flight[addr] < device_in_flight):
+                self.ready_devices.append(addr)
+
+            self.send_batch(batch)
+
+        # still waiting on replies, or done
+        if self.in_flight:
+            return
+
+        if _debug: PrairieDog._debug("    - done")
+
+        #if self.batchToggle == False:
+            #print("records reset")
+        self.records = []
+
+        # add what has been notified since the last cycle
+        if self.cov_values:
+            self.response_values.update(self.cov_values)
+            self.sample_times.update(self.cov_times)
+            self.cov_values = {}
+            self.cov_times = {}
+
+        # how long it took from starting up to the first readings
+        if self.response_values and (self.first_reading is None):
+            self.first_reading = time.monotonic() - process_start
+            first_reading_seconds.set(self.first_reading)
+            print("first readings %.1f s after starting" % (self.first_reading,))
+
+        # keep everything that was read before anything is left out
+        if self.archive:
+            times = self.sample_times
+            self.archive.append([(int(times[point]) / 1000.0, (point.bacnet_ref, point.obj_id, point.prop_id), value)
+                                 for point, value in self.response_values.items()])
+
+        # numbers go into the window rather than out on their own
+        if aggregate_window:
+            self.aggregate_values()
+
+        # leave out what hasn't changed enough to be worth sending
+        if report_by_exception:
+            self.filter_unchanged()
+
+        # dump out the results
+        self.records = build_records(point_table, self.response_values, self.sample_times)
+
+        # for batching applications only
+        #self.batchToggle = not self.batchToggle
+        #if self.batchToggle == False:
+
+        # a window has closed
+        if aggregate_window and (time.time() >= self.window_start + aggregate_window):
+            self.records.extend(self.aggregate_records())
+
+        if self.records:
+            self.uploader.put(self.records)
+
+        cycle_seconds.observe(time.monotonic() - self.cycle_start)
+        cycle_records.set(len(self.records))
+        records_built.inc(len(self.records))
+
+        # no longer busy
+        self.is_busy = False
+
+        # ticks that came while this cycle was running
+        if self.backlog:
+            self.backlog -= 1
+            late_cycles.inc()
+            deferred(self.start_cycle)
+
+    def aggregate_values(self):
+        if _debug: PrairieDog._debug("aggregate_values")
+
+        slots = []
+        values = []
+        for point, value in list(self.response_values.items()):
+            slot = self.aggregate_slots.get(point)
+            if slot is None:
+                continue
+            del self.response_values[point]
+
+            # errors are counted where they happen, not averaged
+            if isinstance(value, float):
+                slots.append(slot)
+                values.append(value)
+
+        self.aggregator.add(slots, values)
+
+    def aggregate_records(self):
+        if _debug: PrairieDog._debug("aggregate_records")
+
+        # stamped with the start of the window
+        window_time = str(int(self.window_start * 1000))
+        self.window_start = time.time() // aggregate_window * aggregate_window
+
+        records = []
+        channels = {}
+        for slot, low, high, mean, last, count in self.aggregator.take():
+            point = self.aggregate_points[slot]
+            measure_values = [
+                ('min', repr(low), 'DOUBLE'),
+                ('max', repr(high), 'DOUBLE'),
+                ('mean', repr(mean), 'DOUBLE'),
+                ('last', repr(last), 'DOUBLE'),
+                ('count', str(count), 'BIGINT'),
+                ]
+
+            if point.measure:
+                channel, name, measureType = point.measure
+                key = (point.bacnet_ref, channel)
+                if key not in channels:
+                    channels[key] = {
+                        'Time': window_time,
+                        'Dimensions': [{'Name': 'tag', 'Value': point.bacnet_ref},
+                                       {'Name': 'channel', 'Value': channel}],
+                        'MeasureName': 'flow_channel_window',
+                        'MeasureValues': [],
+                        'MeasureValueType': 'MULTI',
+                        }
+                    records.append(channels[key])
+                channels[key]['MeasureValues'].extend(
+                    {'Name': name + '_' + kind, 'Value': value, 'Type': value_type}
+                    for kind, value, value_type in measure_values)
+                continue
+
+            records.append({
+                'Time': window_time,
+                'Dimensions': [{'Name': 'tag', 'Value': point.bacnet_ref},
+                               {'Name': 'BACnet_ref', 'Value': point.obj_id}],
+                'MeasureName': point.prop_id + '_window',
+                'MeasureValues': [{'Name': kind, 'Value': value, 'Type': value_type}
+                                  for kind, value, value_type in measure_values],
+                'MeasureValueType': 'MULTI',
+                })
+
+        return records
+
+    def filter_unchanged(self):
+        if _debug: PrairieDog._debug("filter_unchanged")
+        now = time.time()
+
+        for point, value in list(self.response_values.items()):
+            last = self.last_reported.get(point)
+
+            # never sent or due a heartbeat
+            if (last is None) or (now - last[1] >= heartbeat):
+                self.last_reported[point] = (value, now)
+                continue
+
+            last_value = last[0]
+            if value == last_value:
+                del self.response_values[point]
+            elif isinstance(value, float) and isinstance(last_value, float) and \
+                    (point.deadband is not None) and (abs(value - last_value) < point.deadband):
+                del self.response_values[point]
+            else:
+                self.last_reported[point] = (value, now)
+
+    def request_deadbands(self):
+        if _debug: PrairieDog._debug("request_deadbands")
+        self.deadbands_requested = True
+
+        for point in point_table:
+            if (point.value_type != "DOUBLE") or (point.deadband is not None):
+                continue
+
+            # build a request
+            request = ReadPropertyRequest(
+                objectIdentifier=point.object_identifier,
+                propertyIdentifier='covIncrement',
+                )
+            request.pduDestination = point.address
+
+            # make an IOCB
+            iocb = IOCB(request)
+
+            # set a callback for the response
+            iocb.add_callback(self.complete_deadband, point)
+
+            # give it to the application
+            self.request_io(iocb)
+
+    def complete_deadband(self, iocb, point):
+        if _debug: PrairieDog._debug("complete_deadband %r %r", iocb, point)
+
+        # without an answer only unchanged values are left out
+        if iocb.ioResponse:
+            point.deadband = iocb.ioResponse.propertyValue.cast_out(Real)
+            if _debug: PrairieDog._debug("    - deadband: %r", point.deadband)
+
+        if iocb.ioError:
+            if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
+
+    def check_revisions(self):
+        if _debug: PrairieDog._debug("check_revisions")
+        self.revision_check_time = time.monotonic() + discovery_check
+
+        for addr, (instance, revision) in database_revisions.items():
+            request = ReadPropertyRequest(
+                objectIdentifier=('device', instance),
+                propertyIdentifier='databaseRevision',
+                )
+            request.pduDestination = Address(addr)
+
+            iocb = IOCB(request)
+            iocb.add_callback(self.complete_revision, addr, revision)
+            self.request_io(iocb)
+
+        for addr, (instance, object_ids) in object_lists.items():
+            request = ReadPropertyRequest(
+                objectIdentifier=('device', instance),
+                propertyIdentifier='objectList',
+                )
+            request.pduDestination = Address(addr)
+
+            iocb = IOCB(request)
+            iocb.add_callback(self.complete_object_list, addr, object_ids)
+            self.request_io(iocb)
+
+    def complete_revision(self, iocb, addr, revision):
+        if _debug: PrairieDog._debug("complete_revision %r %r %r", iocb, addr, revision)
+
+        if iocb.ioError:
+            if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
+            return
+
+        # stop, main starts again with a fresh discovery
+        value = iocb.ioResponse.propertyValue.cast_out(Unsigned)
+        if (value != revision) and not self.rediscover:
+            print("objects changed on", addr, "rediscovering")
+            self.rediscover = True
+            stop()
+
+    def complete_object_list(self, iocb, addr, object_ids):
+        if _debug: PrairieDog._debug("complete_object_list %r %r", iocb, addr)
+
+        if iocb.ioError:
+            if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
+            return
 
-            # no longer busy
-            self.is_busy = False
+        # stop, main starts again with a fresh discovery
+        if (read_object_ids(iocb.ioResponse.propertyValue) != object_ids) and not self.rediscover:
+            print("objects changed on", addr, "rediscovering")
+            self.rediscover = True
+            stop()
 
+    def send_batch(self, batch):
+        if _debug: PrairieDog._debug("send_batch %r", batch)
+        device = devices[batch[0].addr]
+
+        if len(batch) > 1:
+            # build a request, all of the device's points unless some are
+            # covered by subscriptions
+            if batch is device.points:
+                read_access_specs = device.read_access_specs
+            else:
+                read_access_specs = _read_access_specs(batch)
+            request = ReadPropertyMultipleRequest(listOfReadAccessSpecs=read_access_specs)
+            request.pduDestination = device.address
+            if _debug: PrairieDog._debug("    - request: %r", request)
+
+            # make an IOCB
+            iocb = IOCB(request)
+            if _debug: PrairieDog._debug("    - iocb: %r", iocb)
+
+            # set a callback for the response
+            self.track(iocb, device, batch)
+            iocb.add_callback(self.complete_multiple_request, batch)
+
+            # give it to the application
+            self.request_io(iocb)
             return
 
-        # get the next request
-        addr, obj_id, prop_id, bacnet_ref = self.point_queue.popleft()
-        obj_id = ObjectIdentifier(obj_id).value
+        point = batch[0]
 
         # build a request
         request = ReadPropertyRequest(
-            objectIdentifier=obj_id,
-            propertyIdentifier=prop_id,
+            objectIdentifier=point.object_identifier,
+            propertyIdentifier=point.prop_id,
             )
-        request.pduDestination = Address(addr)
+        request.pduDestination = point.address
         if _debug: PrairieDog._debug("    - request: %r", request)
 
         # make an IOCB
@@ -190,58 +1094,716 @@ class PrairieDog(BIPSimpleApplication, RecurringTask):
         if _debug: PrairieDog._debug("    - iocb: %r", iocb)
 
         # set a callback for the response
-        iocb.add_callback(self.complete_request)
+        self.track(iocb, device, batch)
+        iocb.add_callback(self.complete_request, point)
 
         # give it to the application
         self.request_io(iocb)
 
-    def complete_request(self, iocb):
-        if _debug: PrairieDog._debug("complete_request %r", iocb)
+    def track(self, iocb, device, batch):
+        if _debug: PrairieDog._debug("track %r %r", iocb, device)
+
+        # time the request and send it again at the device's deadline
+        iocb.retransmitted = False
+        deadline = FunctionTask(self.request_timeout, iocb, device)
+        deadline.install_task(delta=device.timeout)
+        iocb.add_callback(self.complete_tracking, device, batch, time.monotonic(), deadline)
+
+    def request_timeout(self, iocb, device):
+        if _debug: PrairieDog._debug("request_timeout %r %r", iocb, device)
+        request = iocb.args[0]
+
+        # a resend the same as bacpypes' own, only sooner, until it runs out
+        # of retries and gives up with noResponse
+        for tr in self.smap.clientTransactions:
+            if (tr.pdu_address == request.pduDestination) and (tr.invokeID == request.apduInvokeID):
+                if tr.state == AWAIT_CONFIRMATION:
+                    iocb.retransmitted = True
+                    tr.await_confirmation_timeout()
+                break
+
+        # still waiting for this try, or behind another request to the same device
+        if iocb.ioComplete.is_set():
+            return
+        FunctionTask(self.request_timeout, iocb, device).install_task(delta=device.timeout)
+
+    def complete_tracking(self, iocb, device, batch, start, deadline):
+        if _debug: PrairieDog._debug("complete_tracking %r %r", iocb, device)
+        elapsed = time.monotonic() - start
+
+        if deadline.isScheduled:
+            deadline.suspend_task()
+
+        device_read_seconds.observe(elapsed, device=device.addr)
+        for point in batch:
+            point_read_seconds.observe(elapsed, device=point.addr, object=point.obj_id, property=point.prop_id)
+        if iocb.ioError:
+            bacnet_errors.inc(type=_error_type(iocb.ioError))
+
+        # anything but silence means the device is there
+        if isinstance(iocb.ioError, AbortPDU) and (str(iocb.ioError) == 'noResponse'):
+            device.failure()
+
+            # no point sending the rest of this cycle's reads
+            if device.open_until:
+                self.point_queues[device.addr].clear()
+        else:
+            # a reply to a resend could be to either send, so it isn't timed
+            device.success(None if iocb.retransmitted else elapsed)
+
+    def complete_request(self, iocb, point):
+        if _debug: PrairieDog._debug("complete_request %r %r", iocb, point)
 
         if iocb.ioResponse:
             apdu = iocb.ioResponse
 
-            # find the datatype
-            datatype = get_datatype(apdu.objectIdentifier[0], apdu.propertyIdentifier)
-            if _debug: PrairieDog._debug("    - datatype: %r", datatype)
-            if not datatype:
-                raise TypeError("unknown datatype")
-
-            # special case for array parts, others are managed by cast_out
-            if issubclass(datatype, Array) and (apdu.propertyArrayIndex is not None):
-                if apdu.propertyArrayIndex == 0:
-                    value = apdu.propertyValue.cast_out(Unsigned)
-                else:
-                    value = apdu.propertyValue.cast_out(datatype.subtype)
-            else:
-                value = apdu.propertyValue.cast_out(datatype)
+            value = _cast_value(point.datatype, apdu.propertyArrayIndex, apdu.propertyValue)
             if _debug: PrairieDog._debug("    - value: %r", value)
 
             # save the value
-            self.response_values.append(value)
+            self.response_values[point] = value
+
+        if iocb.ioError:
+            if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
+            self.response_values[point] = iocb.ioError
+
+        # stamped when it came in rather than when the cycle ends
+        self.sample_times[point] = _time_ms()
+
+        # fire off another request
+        self.release(point.addr)
+        deferred(self.next_request)
+
+    def complete_multiple_request(self, iocb, batch):
+        if _debug: PrairieDog._debug("complete_multiple_request %r %r", iocb, batch)
+
+        # one time for everything in the reply
+        sample_time = _time_ms()
+        for point in batch:
+            self.sample_times[point] = sample_time
+
+        if iocb.ioResponse:
+            apdu = iocb.ioResponse
+
+            # match the results to points by object and property
+            index = devices[batch[0].addr].index
+            for result in apdu.listOfReadAccessResults:
+                obj_id = result.objectIdentifier
+                for element in result.listOfResults:
+                    point = index.get((obj_id, element.propertyIdentifier))
+                    if point is None:
+                        continue
+                    read_result = element.readResult
+                    if read_result.propertyAccessError is not None:
+                        value = read_result.propertyAccessError
+                        bacnet_errors.inc(type=_error_type(value))
+                    else:
+                        value = _cast_value(point.datatype, element.propertyArrayIndex, read_result.propertyValue)
+                    if _debug: PrairieDog._debug("    - value: %r %r", point, value)
+
+                    # save the value
+                    self.response_values[point] = value
 
         if iocb.ioError:
             if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
-            self.response_values.append(iocb.ioError)
+
+            if _rpm_unsupported(iocb.ioError):
+                # read this device one property at a time from now on
+                self.single_read_devices.add(batch[0].addr)
+                self.point_queues[batch[0].addr].extendleft([point] for point in reversed(batch))
+            else:
+                for point in batch:
+                    self.response_values[point] = iocb.ioError
 
         # fire off another request
+        self.release(batch[0].addr)
         deferred(self.next_request)
 
+    def release(self, addr):
+        if _debug: PrairieDog._debug("release %r", addr)
+
+        # one less request in flight
+        self.in_flight -= 1
+        self.device_in_flight[addr] -= 1
+
+        # the device can go again if it has more to read
+        if self.point_queues[addr]:
+            self.ready_devices.append(addr)
+
+    def subscribe_cov(self):
+        if _debug: PrairieDog._debug("subscribe_cov")
+
+        # renew half way through the lifetime
+        self.cov_renew_time = time.monotonic() + cov_lifetime / 2
+
+        for key, point in self.cov_points.items():
+            if key[0] in self.cov_refused_devices:
+                continue
+
+            # build a request
+            request = SubscribeCOVRequest(
+                subscriberProcessIdentifier=cov_process_id,
+                monitoredObjectIdentifier=key[1],
+                issueConfirmedNotifications=False,
+                lifetime=cov_lifetime,
+                )
+            request.pduDestination = key[0]
+            if _debug: PrairieDog._debug("    - request: %r", request)
+
+            # make an IOCB
+            iocb = IOCB(request)
+
+            # set a callback for the response
+            iocb.add_callback(self.complete_subscribe, key)
+
+            # give it to the application
+            self.request_io(iocb)
+
+    def complete_subscribe(self, iocb, key):
+        if _debug: PrairieDog._debug("complete_subscribe %r %r", iocb, key)
+        point = self.cov_points[key]
+
+        if iocb.ioResponse:
+            self.cov_active.add(point)
+
+        if iocb.ioError:
+            if _debug: PrairieDog._debug("    - error: %r", iocb.ioError)
+
+            # an answer, rather than a timeout, means the device won't do COV
+            # so poll all of its points from now on
+            if not (isinstance(iocb.ioError, AbortPDU) and str(iocb.ioError) == 'noResponse'):
+                self.cov_refused_devices.add(key[0])
+                for other_key, other_point in self.cov_points.items():
+                    if other_key[0] == key[0]:
+                        self.cov_active.discard(other_point)
+            else:
+                self.cov_active.discard(point)
+
+    def do_UnconfirmedCOVNotificationRequest(self, apdu):
+        if _debug: PrairieDog._debug("do_UnconfirmedCOVNotificationRequest %r", apdu)
+
+        # not one of ours
+        if apdu.subscriberProcessIdentifier != cov_process_id:
+            return
+        point = self.cov_points.get((apdu.pduSource, apdu.monitoredObjectIdentifier))
+        if point is None:
+            return
+
+        # keep the latest value until the next cycle
+        for element in apdu.listOfValues:
+            if element.propertyIdentifier == "presentValue":
+                self.cov_values[point] = _cast_value(point.datatype, element.propertyArrayIndex, element.value)
+                self.cov_times[point] = _time_ms()
+                if _debug: PrairieDog._debug("    - value: %r", self.cov_values[point])
+
+
+def build_records(points, values, times):
+    # only the time and the value are new for each record, everything else
+    # is copied from the point's template or shared with it - a multi-measure
+    # record has the time of its first measure
+    records = []
+    channels = {}
+    for point in points:
+        response = values.get(point)
+        if response is None:
+            continue
+
+        if point.measure:
+            value = _measure_value(response, point.measure[2])
+            if value is None:
+                continue
+            record = channels.get(point.channel_key)
+            if record is None:
+                record = channels[point.channel_key] = point.channel_template.copy()
+                record['Time'] = times[point]
+                record['MeasureValues'] = []
+                records.append(record)
+            measure_value = point.template.copy()
+            measure_value['Value'] = value
+            record['MeasureValues'].append(measure_value)
+            continue
+
+        # an error is no value for a numeric point, only a text one keeps it
+        if (point.value_type == "DOUBLE") and not isinstance(response, (int, float, str)):
+            continue
+        record = point.template.copy()
+        record['Time'] = times[point]
+        record['MeasureValue'] = str(response)
+        records.append(record)
+
+    return records
+
+
+def _time_ms():
+    # Timestream's default time unit
+    return str(int(round(time.time() * 1000)))
+
+
+def _measure_value(value, value_type):
+    # errors and anything else that doesn't fit the type are left out
+    if value_type == "DOUBLE":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return str(value)
+    if value_type == "BOOLEAN":
+        if not isinstance(value, bool):
+            return None
+        return str(value).lower()
+    if not isinstance(value, str):
+        return None
+    return value
+
+
+def _error_type(err):
+    # a short name for each kind of BACnet error
+    if isinstance(err, AbortPDU):
+        return "abort:" + str(err)
+    if isinstance(err, RejectPDU):
+        return "reject:" + str(RejectReason._xlate_table.get(err.apduAbortRejectReason, err.apduAbortRejectReason))
+    if hasattr(err, "errorCode"):
+        return "%s:%s" % (err.errorClass, err.errorCode)
+    return type(err).__name__
+
+
+def _rpm_unsupported(err):
+    # rejected outright, e.g. unrecognizedService, or too big to answer
+    if isinstance(err, RejectPDU):
+        return True
+    if isinstance(err, AbortPDU):
+        return str(err) in RPM_FALLBACK_ABORTS
+    return False
+
+
+def _cast_value(datatype, array_index, property_value):
+    # special case for array parts, others are managed by cast_out
+    if issubclass(datatype, Array) and (array_index is not None):
+        if array_index == 0:
+            return property_value.cast_out(Unsigned)
+        return property_value.cast_out(datatype.subtype)
+    return property_value.cast_out(datatype)
+
+
+#
+#   Uploader
+#
+@bacpypes_debugging
+class Uploader:
+
+    def __init__(self, maxsize):
+        if _debug: Uploader._debug("__init__ %r", maxsize)
+
+        # every cycle goes to each of them
+        self.sinks = [make_sink(name, maxsize) for name in sink_names]
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def put(self, records):
+        if _debug: Uploader._debug("put %r", len(records))
+
+        # the timestamps can't be trusted yet
+        if not clock_synced.is_set():
+            unsynced_cycles.inc()
+            return
+
+        for sink in self.sinks:
+            sink.put(records)
 
-def _print_rejected_recrods_Exceptions(err):
-    print("RejectedRecords: ",err)
-    for rr in err.response["RejectedRecords"]:
-        print("Rejected Index " + str(rr["RecordIndex"]) + ": " + rr["Reason"])
-        if "ExistingVersion" in rr:
-            print("Rejected record existing version: ", rr["ExistingVersion"])
+    def flush(self, timeout):
+        # one deadline for all of them
+        deadline = time.monotonic() + timeout
+        for sink in self.sinks:
+            if not sink.flush(max(0.0, deadline - time.monotonic())):
+                print("Upload for", sink.sink_name, "not finished, leaving it")
+
+#
+#   TimestreamSink
+#
+class TimestreamSink(Sink):
+
+    def write(self, records):
+        return write_records(records)
+
+
+def make_sink(name, queue_size):
+    # batching and spooling are the same for every kind of sink
+    prefix = name.upper() + "_"
+    batch_records = int(os.getenv(prefix + "BATCH_RECORDS", str(spool_drain_records)))
+    batch_seconds = float(os.getenv(prefix + "BATCH_SECONDS", "0"))
+    path = None
+    if spool_path:
+        path = spool_path if name == "timestream" else spool_path + "." + name
+    options = (queue_size, batch_records, batch_seconds, path, spool_max_bytes)
+
+    if name == "timestream":
+        return TimestreamSink(name, *options)
+    if name == "file":
+        return FileSink(file_sink_path, *options)
+    if name == "influx":
+        return InfluxSink(influx_url, influx_org, influx_bucket, influx_token, *options)
+    if name == "mqtt":
+        return MqttSink(mqtt_host, mqtt_port, mqtt_topic, mqtt_username, mqtt_password, mqtt_qos, *options)
+    raise ValueError("unknown sink: %r" % (name,))
+
+
+#
+#   PipeUploader
+#
+class PipeUploader:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def put(self, records):
+        # the supervisor is always reading, so this doesn't hold up polling
+        try:
+            self.conn.send(records)
+        except OSError:
+            # nobody left to upload for
+            print("Supervisor gone, stopping")
+            stop()
+
+
+def worker_main(index, interval, ini, points, measures, discovered, started, conn):
+    global point_table, devices, archive_path, discovery_backoff, process_start
+
+    # startup times count from when the supervisor started
+    process_start = started
+
+    # only this worker's share of the devices, in the order they are listed
+    addrs = set(list(dict.fromkeys(point[0] for point in points))[index::workers])
+    multi_measures.update(measures)
+    point_table, devices = compile_points([point for point in points if point[0] in addrs])
+
+    # and only their changes to look out for, the first worker tries discovery
+    # again when some of the devices didn't answer
+    revisions, lists, backoff = discovered
+    database_revisions.update((addr, value) for addr, value in revisions.items() if addr in addrs)
+    object_lists.update((addr, value) for addr, value in lists.items() if addr in addrs)
+    if index == 0:
+        discovery_backoff = backoff
+
+    # an archive each, they can't share the files
+    if archive_path:
+        archive_path = os.path.join(archive_path, "worker%d" % index)
+
+    # a device and a port of its own, counting up from the configured ones
+    ini = Settings(ini)
+    ini.objectidentifier = str(int(ini.objectidentifier) + index)
+    this_device = LocalDeviceObject(ini=ini)
+    address = "%s:%d" % (ini.address.partition(":")[0], worker_port + index)
+
+    this_application = PrairieDog(interval, this_device, address, uploader=PipeUploader(conn))
+    if metrics_port:
+        metrics.serve(metrics_port + 1 + index, metrics_host)
+    print("worker", index, "polling", len(devices), "devices from", address)
+
+    # a supervisor that is killed outright doesn't take its workers with it
+    threading.Thread(target=_watch_supervisor, name="supervisor", daemon=True).start()
+    run()
+
+    # the supervisor starts everything again to discover the devices afresh
+    if this_application.archive:
+        this_application.archive.flush()
+    if this_application.rediscover:
+        sys.exit(REDISCOVER_EXIT)
+
+
+def _watch_supervisor():
+    wait([multiprocessing.parent_process().sentinel])
+    print("Supervisor gone, stopping")
+    deferred(stop)
+
+
+def start_worker(index, interval, ini):
+    # spawned rather than forked, the supervisor has threads running
+    context = multiprocessing.get_context("spawn")
+    reader, writer = context.Pipe(duplex=False)
+    discovered = (database_revisions, object_lists, discovery_backoff)
+    process = context.Process(target=worker_main, args=(index, interval, dict(ini), point_list, multi_measures, discovered, process_start, writer), name="worker%d" % index, daemon=True)
+    process.start()
+    writer.close()
+    return process, reader
+
+
+def supervise(interval, ini):
+    # one uploader for every worker's cycles
+    uploader = Uploader(upload_queue_size * workers)
+    uploader.start()
+    if metrics_port:
+        metrics.serve(metrics_port, metrics_host)
+
+    running = {}
+    for index in range(workers):
+        process, reader = start_worker(index, interval, ini)
+        running[reader] = (index, process)
+
+    while True:
+        for reader in wait(list(running)):
+            try:
+                uploader.put(reader.recv())
+            except EOFError:
+                index, process = running.pop(reader)
+                process.join()
+
+                # a worker that saw the objects change has everyone start again,
+                # the others hand over their last cycles first
+                if process.exitcode == REDISCOVER_EXIT:
+                    for index, process in running.values():
+                        process.terminate()
+                    for reader in running:
+                        try:
+                            while True:
+                                uploader.put(reader.recv())
+                        except EOFError:
+                            pass
+                    for index, process in running.values():
+                        process.join()
+                    restart(uploader)
+
+                # start it again rather than lose its devices
+                print("worker", index, "stopped with exit code", process.exitcode, "- restarting")
+                time.sleep(1)
+                process, reader = start_worker(index, interval, ini)
+                running[reader] = (index, process)
+
+
+def wait_until_ready(address):
+    # the local address and port from the ini file
+    host, _, port = address.partition(":")
+    host = host.partition("/")[0]
+    port = int(port or 47808)
+
+    # binding fails until the interface has the address and the port is free
+    deadline = time.monotonic() + startup_timeout
+    waiting_for = None
+    while True:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.bind((host, port))
+            print("network ready %.1f s after starting" % (time.monotonic() - process_start,))
+            return True
+        except OSError as err:
+            if time.monotonic() >= deadline:
+                print("network still not ready:", err)
+                return False
+            if waiting_for != err.errno:
+                waiting_for = err.errno
+                print("waiting for", host, "port", port, "-", err.strerror)
+            time.sleep(0.5)
+
+
+def clock_in_sync():
+    # what systemd thinks, None when it can't say
+    try:
+        result = subprocess.run(["timedatectl", "show", "-p", "NTPSynchronized", "--value"],
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() == "yes" if result.returncode == 0 else None
+
+
+def sync_clock():
+    # nothing to do when the clock is already right
+    if not ntp_sync or clock_in_sync():
+        clock_synced.set()
+        return
+
+    # step the clock once with ntpd, then leave the service to keep it there
+    for command in (["/etc/init.d/ntp", "stop"], ["ntpd", "-q", "-g"], ["/etc/init.d/ntp", "start"]):
+        try:
+            result = subprocess.run(command, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode:
+                print(" ".join(command), "exited with", result.returncode)
+        except (OSError, subprocess.TimeoutExpired) as err:
+            print(" ".join(command), "failed:", err)
+
+    print("clock synchronised %.1f s after starting" % (time.monotonic() - process_start,))
+    clock_synced.set()
+
+
+def write_records(records):
+    futures = [write_pool.submit(_write_chunk, common, chunk) for common, chunk in write_chunks(records)]
+
+    # wait for them all, false if any of them should be sent again
+    results = [future.result() for future in futures]
+    return all(results)
+
+
+def write_chunks(records):
+    # chunks share a value type so it can go in CommonAttributes
+    groups = {}
+    for record in records:
+        groups.setdefault(record['MeasureValueType'], []).append(record)
+
+    for group in groups.values():
+        for i in range(0, len(group), MAX_RECORDS_PER_WRITE):
+            yield _common_attributes(group[i:i + MAX_RECORDS_PER_WRITE])
+
+
+def _common_attributes(chunk):
+    first = chunk[0]
+    common = {'MeasureValueType': first['MeasureValueType']}
+
+    # the time and any dimensions every record in the chunk has move up as well
+    if all(record['Time'] == first['Time'] for record in chunk):
+        common['Time'] = first['Time']
+    shared = [dimension for dimension in first['Dimensions']
+              if all(dimension in record['Dimensions'] for record in chunk)]
+    if shared:
+        common['Dimensions'] = shared
+
+    # a record keeps its own Dimensions list unless some of it moved up
+    moved = [key for key in common if key != 'Dimensions']
+    records = []
+    for record in chunk:
+        slim = record.copy()
+        for key in moved:
+            del slim[key]
+        if shared:
+            dimensions = [dimension for dimension in record['Dimensions'] if dimension not in shared]
+            if dimensions:
+                slim['Dimensions'] = dimensions
+            else:
+                del slim['Dimensions']
+        records.append(slim)
+    return common, records
+
+
+def _write_chunk(common, records):
+    # replace with correct database and table names
+    client = get_client()
+    written = False
+    for attempt in range(write_attempts):
+        write_bucket.take(len(records))
+        write_limit.acquire()
+        throttled = retry = False
+        start = time.monotonic()
+        try:
+            result = client.write_records(DatabaseName=os.getenv("DATABASE"), TableName=os.getenv("TABLE"), CommonAttributes=common, Records=records)
+            #print("WriteRecords Status: [%s]" % result['ResponseMetadata']['HTTPStatusCode'])
+        except client.exceptions.RejectedRecordsException as err:
+            # the rest went in, only the rejected ones can go again
+            written = True
+            records = _sort_rejected(common, records, err.response["RejectedRecords"])
+            if not records:
+                return True
+            continue
+        except client.exceptions.ThrottlingException as err:
+            write_throttles.inc()
+            print("Error:",err)
+            throttled = retry = True
+        except Exception as err:
+            write_errors.inc()
+            print("Error:",err)
+            retry = _transient(err)
+            if not retry:
+                if written:
+                    _dead_letter(common, [(record, str(err)) for record in records])
+                    return True
+                return False
+        finally:
+            write_seconds.observe(time.monotonic() - start)
+            write_limit.release(throttled)
+
+        if not retry:
+            return True
+
+        # full jitter, outside the limit so the others can go meanwhile
+        time.sleep(random.uniform(0, min(write_backoff_max, write_backoff * 2 ** attempt)))
+
+    # the whole chunk can wait in the spool, what is left of one can't
+    if written:
+        print("Still rejected after", write_attempts, "attempts,", len(records), "dead lettered")
+        _dead_letter(common, [(record, "still rejected after %d attempts" % write_attempts) for record in records])
+        return True
+    print("Failed", write_attempts, "times, giving up on", len(records), "records for now")
+    return False
+
+
+def _transient(err):
+    # botocore's own retries are off, so these are retried here: connection
+    # failures, timeouts and server errors
+    from botocore.exceptions import ConnectionError, HTTPClientError
+    if isinstance(err, (ConnectionError, HTTPClientError)):
+        return True
+    response = getattr(err, "response", None) or {}
+    return response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+
+
+def _sort_rejected(common, records, rejected):
+    # the records worth sending again, with a higher version when one with
+    # the same time, dimensions and measure is already there
+    again = []
+    dead = []
+    for rr in rejected:
+        record = records[rr["RecordIndex"]]
+        reason = rr.get("Reason", "")
+        existing = rr.get("ExistingVersion")
+
+        if (existing is not None) and (record.get('Version', 1) <= existing < MAX_RECORD_VERSION):
+            again.append(dict(record, Version=existing + 1))
+            write_rejected.inc(action="versioned")
+        elif any(retryable in reason.lower() for retryable in RETRYABLE_REJECTIONS):
+            again.append(record)
+            write_rejected.inc(action="retried")
+        else:
+            dead.append((record, reason))
+            write_rejected.inc(action="dead_letter")
+
+    print("RejectedRecords:", len(rejected), "of", len(records), "-", len(again), "sent again,", len(dead), "dead lettered")
+    if dead:
+        _dead_letter(common, dead)
+    return again
+
+
+def _dead_letter(common, records):
+    # whole records, with the attributes they shared with the rest of the chunk
+    lines = []
+    now = int(time.time() * 1000)
+    for record, reason in records:
+        full = dict(common, **record)
+        full['Dimensions'] = common.get('Dimensions', []) + record.get('Dimensions', [])
+        lines.append(json.dumps({'time': now, 'reason': reason, 'record': full}, separators=(',', ':')))
+
+    dead_letters.inc(len(lines))
+    with dead_letter_lock:
+        try:
+            # the one before is all that is kept, like a rotated log
+            if os.path.exists(dead_letter_path) and (os.path.getsize(dead_letter_path) >= dead_letter_max_bytes):
+                os.replace(dead_letter_path, dead_letter_path + ".1")
+            with open(dead_letter_path, "a") as dead_letter_file:
+                dead_letter_file.write("\n".join(lines) + "\n")
+        except OSError as err:
+            print("Error: dead letter file", err)
+
+def restart(uploader):
+    # what was read so far is written, or spooled, before starting again
+    uploader.flush(RESTART_FLUSH_SECONDS)
+    argv = [sys.executable] + _strip_rediscover(sys.argv) + ["--rediscover"]
+    if discovery_backoff:
+        argv += ["--discovery-backoff", str(min(discovery_backoff * 2, discovery_retry_max))]
+    os.execv(sys.executable, argv)
+
+
+def _strip_rediscover(argv):
+    # the arguments without those added for the last rediscovery
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--discovery-backoff":
+            skip = True
+        elif arg != "--rediscover":
+            stripped.append(arg)
+    return stripped
 
 #
 #   __main__
 #
 def main():
-    # wait for a bit so that the IT connection is established on boot
-    time.sleep(60)
-
     logging.basicConfig()
     # parse the command line arguments
     parser = ConfigArgumentParser(description=__doc__)
@@ -251,6 +1813,16 @@ def main():
           help='repeat rate in seconds',
           )
 
+    # ignore the discovery cache
+    parser.add_argument('--rediscover', action='store_true',
+          help='discover the devices again',
+          )
+
+    # how long the last incomplete discovery waited
+    parser.add_argument('--discovery-backoff', type=float,
+          help=argparse.SUPPRESS,
+          )
+
     # now parse the arguments
     args = parser.parse_args()
 
@@ -264,19 +1836,33 @@ def main():
 
     # reboot the system on all uncaught exceptions to ensure best attempt at logging
     try:
-        os.system("timeout 60 /etc/init.d/ntp stop")
-        print("ntp stopped")
-        time.sleep(10)
-        os.system("timeout 60 ntpd -q -g")
-        print("ntp synchronizing")
-        time.sleep(10)
-        os.system("timeout 60 /etc/init.d/ntp start")
-        print("ntp restarted")
+        # wait for the network rather than a fixed time after boot
+        wait_until_ready(args.ini.address)
+
+        # set the clock alongside polling
+        threading.Thread(target=sync_clock, name="ntp", daemon=True).start()
+
+        # find the devices, or remember them
+        if discovery:
+            discover_points(args.ini, args.rediscover, args.discovery_backoff)
+
+        # a supervisor and its workers for large sites
+        if workers > 1:
+            supervise(args.interval, args.ini)
+
         # make a dog
         this_application = PrairieDog(args.interval, this_device, args.ini.address)
+        if metrics_port:
+            metrics.serve(metrics_port, metrics_host)
         if _debug: _log.debug("    - this_application: %r", this_application)
         _log.debug("running")
         run()
+
+        # start again from the top to discover the devices afresh
+        if this_application.rediscover:
+            if this_application.archive:
+                this_application.archive.flush()
+            restart(this_application.uploader)
     except:
         print("could not initialise the application - is the network configured correctly?")
         time.sleep(1)
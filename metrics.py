@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Counters, gauges and histograms for the gateway
+
+Exposed over HTTP in the Prometheus text format, updates are thread safe so
+both the BACnet thread and the upload threads can record into them
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+# every metric, in the order they are exposed
+registry = []
+
+# seconds, from a fast local read up to a stalled upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+#
+#   Metric
+#
+class Metric:
+
+    kind = "untyped"
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+
+        # values by label set, or a function called when scraped
+        self.values = {}
+        self.function = function
+        self.lock = threading.Lock()
+
+        registry.append(self)
+
+    def set_function(self, function):
+        self.function = function
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        if self.function:
+            lines.append("%s %s" % (self.name, _number(self.function())))
+        else:
+            with self.lock:
+                for labels, value in self.values.items():
+                    lines.append("%s%s %s" % (self.name, _labels(labels), _number(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            # per bucket counts, the last one is +Inf, then the sum
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.kind)]
+        with self.lock:
+            for labels, counts in self.values.items():
+                # buckets are cumulative in the exposition format
+                total = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    total += count
+                    le = bound if isinstance(bound, str) else _number(bound)
+                    lines.append("%s_bucket%s %d" % (self.name, _labels(labels + (("le", le),)), total))
+                lines.append("%s_sum%s %s" % (self.name, _labels(labels), _number(counts[-1])))
+                lines.append("%s_count%s %d" % (self.name, _labels(labels), total))
+        return lines
+
+
+def expose():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+#
+#   MetricsHandler
+#
+@bacpypes_debugging
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if _debug: MetricsHandler._debug("do_GET %r", self.path)
+
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes would flood the console
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    # answer scrapes on a thread of their own, and carry on without them when
+    # the port can't be had
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as err:
+        print("Error: metrics not served on port", port, err)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -5,11 +5,21 @@ This sample application is a server that supports many core services that
 applications need to present data on a BACnet network.  It supports Who-Is
 and I-Am for device binding, Read and Write Property, Read and Write
 Property Multiple, and COV subscriptions.
+
+The objects follow the Flexim channel layout, chA and chB for the measuring
+channels and chX and chY for the calculated flow channels, and their values
+move with time: sines, random walks, step changes, totalizers integrating
+their flow, and now and then a channel fault.
 """
 
+import math
+import random
+import time
+
 from bacpypes.consolelogging import ConfigArgumentParser
 
 from bacpypes.core import run
+from bacpypes.task import RecurringTask
 
 from bacpypes.app import BIPSimpleApplication
 from bacpypes.object import AnalogValueObject, AnalogInputObject
@@ -21,712 +31,273 @@ from bacpypes.service.object import ReadWritePropertyMultipleServices
 # globals
 test_application = None
 
-objectList = [
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 101),
-        objectName="chA medium temperature - supply line",
-        presentValue=0.0,
-        units="degreesCelsius",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 102),
-        objectName="chA medium temperature - return line",
-        presentValue=0.0,
-        units="degreesCelsius",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 103),
-        objectName="chA medium pressure - supply line",
-        presentValue=0.0,
-        units="bars",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 104),
-        objectName="chA medium pressure - return line",
-        presentValue=0.0,
-        units="bars",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 105),
-        objectName="chA signal amplitude",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 106),
-        objectName="chA sound speed",
-        presentValue=0.0,
-        units="metersPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 107),
-        objectName="chA flow velocity",
-        presentValue=0.0,
-        units="metersPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 108),
-        objectName="chA volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 109),
-        objectName="chA volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 110),
-        objectName="chA volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 111),
-        objectName="chA standard volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 112),
-        objectName="chA standard volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 113),
-        objectName="chA standard volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 114),
-        objectName="chA mass flow",
-        presentValue=0.0,
-        units="kilogramsPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 115),
-        objectName="chA mass flow, + totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 116),
-        objectName="chA mass flow, - totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 117),
-        objectName="chA heat flow",
-        presentValue=0.0,
-        units="watts",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 118),
-        objectName="chA heat flow, + totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 119),
-        objectName="chA heat flow, - totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 120),
-        objectName="chA concentration",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 121),
-        objectName="chA SNR",
-        presentValue=0.0,
-        units="decibels",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 122),
-        objectName="chA SCNR",
-        presentValue=0.0,
-        units="decibels",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 123),
-        objectName="chA VariAmp",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 124),
-        objectName="chA VariTime",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 125),
-        objectName="chA detection rate",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 126),
-        objectName="chA diagnostic error bits",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 201),
-        objectName="chB medium temperature - supply line",
-        presentValue=0.0,
-        units="degreesCelsius",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 202),
-        objectName="chB medium temperature - return line",
-        presentValue=0.0,
-        units="degreesCelsius",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 203),
-        objectName="chB medium pressure - supply line",
-        presentValue=0.0,
-        units="bars",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 204),
-        objectName="chB medium pressure - return line",
-        presentValue=0.0,
-        units="bars",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 205),
-        objectName="chB signal amplitude",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 206),
-        objectName="chB sound speed",
-        presentValue=0.0,
-        units="metersPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 207),
-        objectName="chB flow velocity",
-        presentValue=0.0,
-        units="metersPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 208),
-        objectName="chB volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 209),
-        objectName="chB volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 210),
-        objectName="chB volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 211),
-        objectName="chB standard volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 212),
-        objectName="chB standard volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 213),
-        objectName="chB standard volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 214),
-        objectName="chB mass flow",
-        presentValue=0.0,
-        units="kilogramsPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 215),
-        objectName="chB mass flow, + totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 216),
-        objectName="chB mass flow, - totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 217),
-        objectName="chB heat flow",
-        presentValue=0.0,
-        units="watts",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 218),
-        objectName="chB heat flow, + totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 219),
-        objectName="chB heat flow, - totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 220),
-        objectName="chB concentration",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 221),
-        objectName="chB SNR",
-        presentValue=0.0,
-        units="decibels",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 222),
-        objectName="chB SCNR",
-        presentValue=0.0,
-        units="decibels",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 223),
-        objectName="chB VariAmp",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 224),
-        objectName="chB VariTime",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 225),
-        objectName="chB detection rate",
-        presentValue=0.0,
-        units="percent",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 226),
-        objectName="chB diagnostic error bits",
-        presentValue=0.0,
-        units="noUnits",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 1008),
-        objectName="chY volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1009),
-        objectName="chY volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1010),
-        objectName="chY volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 1011),
-        objectName="chY standard volumetric flow rate",
-        presentValue=0.0,
-        units="cubicMetersPerHour",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1012),
-        objectName="chY standard volumetric flow rate, + totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1013),
-        objectName="chY standard volumetric flow rate, - totalizer",
-        presentValue=0.0,
-        units="cubicMeters",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 1014),
-        objectName="chY mass flow",
-        presentValue=0.0,
-        units="kilogramsPerSecond",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1015),
-        objectName="chY mass flow, + totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1016),
-        objectName="chY mass flow, - totalizer",
-        presentValue=0.0,
-        units="kilograms",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogInputObject(
-        objectIdentifier=("analogInput", 1017),
-        objectName="chY heat flow",
-        presentValue=0.0,
-        units="watts",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1018),
-        objectName="chY heat flow, + totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    ),
-    AnalogValueObject(
-        objectIdentifier=("analogValue", 1019),
-        objectName="chY heat flow, - totalizer",
-        presentValue=0.0,
-        units="megawattHours",
-        covIncrement=1.0,
-        statusFlags=[0, 0, 0, 0],
-        eventState="normal",
-        reliability="noFaultDetected",
-        outOfService=False
-    )
-]
+# per channel objects, the instance is the channel base plus the offset
+#   (offset, object type, name, units, covIncrement, signal)
+CHANNEL_TEMPLATE = [
+    (1, "analogInput", "medium temperature - supply line", "degreesCelsius", 0.5, ("sine", 70.0, 5.0, 600)),
+    (2, "analogInput", "medium temperature - return line", "degreesCelsius", 0.5, ("sine", 50.0, 4.0, 600)),
+    (3, "analogInput", "medium pressure - supply line", "bars", 0.1, ("walk", 6.0, 0.02, 4.0, 8.0)),
+    (4, "analogInput", "medium pressure - return line", "bars", 0.1, ("walk", 4.0, 0.02, 2.0, 6.0)),
+    (5, "analogInput", "signal amplitude", "noUnits", 1.0, ("walk", 80.0, 0.5, 60.0, 95.0)),
+    (6, "analogInput", "sound speed", "metersPerSecond", 1.0, ("sine", 1480.0, 3.0, 900)),
+    (7, "analogInput", "flow velocity", "metersPerSecond", 0.05, ("steps", (-0.2, 0.0, 0.8, 1.5, 2.2), 120, 0.02)),
+    (8, "analogInput", "volumetric flow rate", "cubicMetersPerHour", 1.0, ("steps", (-10.0, 0.0, 40.0, 75.0, 110.0), 120, 0.5)),
+    (9, "analogValue", "volumetric flow rate, + totalizer", "cubicMeters", 1.0, ("total", 8, 1, 1 / 3600.0)),
+    (10, "analogValue", "volumetric flow rate, - totalizer", "cubicMeters", 1.0, ("total", 8, -1, 1 / 3600.0)),
+    (11, "analogInput", "standard volumetric flow rate", "cubicMetersPerHour", 1.0, ("steps", (-10.0, 0.0, 38.0, 72.0, 105.0), 120, 0.5)),
+    (12, "analogValue", "standard volumetric flow rate, + totalizer", "cubicMeters", 1.0, ("total", 11, 1, 1 / 3600.0)),
+    (13, "analogValue", "standard volumetric flow rate, - totalizer", "cubicMeters", 1.0, ("total", 11, -1, 1 / 3600.0)),
+    (14, "analogInput", "mass flow", "kilogramsPerSecond", 0.5, ("steps", (-3.0, 0.0, 10.0, 20.0, 30.0), 120, 0.1)),
+    (15, "analogValue", "mass flow, + totalizer", "kilograms", 10.0, ("total", 14, 1, 1.0)),
+    (16, "analogValue", "mass flow, - totalizer", "kilograms", 10.0, ("total", 14, -1, 1.0)),
+    (17, "analogInput", "heat flow", "watts", 1000.0, ("sine", 250000.0, 50000.0, 1200)),
+    (18, "analogValue", "heat flow, + totalizer", "megawattHours", 0.01, ("total", 17, 1, 1 / 3.6e9)),
+    (19, "analogValue", "heat flow, - totalizer", "megawattHours", 0.01, ("total", 17, -1, 1 / 3.6e9)),
+    (20, "analogInput", "concentration", "noUnits", 0.1, ("walk", 1.0, 0.01, 0.0, 5.0)),
+    (21, "analogInput", "SNR", "decibels", 1.0, ("walk", 30.0, 0.2, 20.0, 40.0)),
+    (22, "analogInput", "SCNR", "decibels", 1.0, ("walk", 25.0, 0.2, 15.0, 35.0)),
+    (23, "analogInput", "VariAmp", "percent", 1.0, ("walk", 50.0, 0.5, 30.0, 70.0)),
+    (24, "analogInput", "VariTime", "percent", 1.0, ("walk", 50.0, 0.5, 30.0, 70.0)),
+    (25, "analogInput", "detection rate", "percent", 1.0, ("walk", 99.0, 0.2, 90.0, 100.0)),
+    (26, "analogInput", "diagnostic error bits", "noUnits", 1.0, ("constant", 0.0)),
+    ]
+
+# calculated channels only carry the flows and their totalizers
+FLOW_OFFSETS = range(8, 20)
+
+#   (channel, instance base, offsets)
+CHANNELS = [
+    ("A", 100, None),
+    ("B", 200, None),
+    ("X", 900, FLOW_OFFSETS),
+    ("Y", 1000, FLOW_OFFSETS),
+    ]
+
+# what a faulted channel reports
+FAULT_RELIABILITY = ("overRange", "underRange", "communicationFailure", "unreliableOther")
+
+#
+#   Signals
+#
+
+class Constant:
+
+    def __init__(self, rng, value):
+        self.value = value
+
+    def update(self, now, dt):
+        return self.value
+
+
+class Sine:
+
+    def __init__(self, rng, mean, amplitude, period):
+        self.mean = mean
+        self.amplitude = amplitude
+        self.period = period
+
+        # devices should not all move in step
+        self.phase = rng.uniform(0, 2 * math.pi)
+        self.value = mean
+
+    def update(self, now, dt):
+        self.value = self.mean + self.amplitude * math.sin(2 * math.pi * now / self.period + self.phase)
+        return self.value
+
+
+class RandomWalk:
+
+    def __init__(self, rng, mean, step, low, high):
+        self.rng = rng
+        self.step = step
+        self.low = low
+        self.high = high
+        self.value = mean
+
+    def update(self, now, dt):
+        value = self.value + self.rng.gauss(0, self.step * math.sqrt(dt))
+
+        # bounce off the limits
+        if value < self.low:
+            value = 2 * self.low - value
+        elif value > self.high:
+            value = 2 * self.high - value
+        self.value = min(max(value, self.low), self.high)
+        return self.value
+
+
+class Steps:
+
+    def __init__(self, rng, levels, hold, noise):
+        self.rng = rng
+        self.levels = levels
+        self.hold = hold
+        self.noise = noise
+
+        self.level = rng.choice(levels)
+        self.next_step = 0.0
+        self.value = self.level
+
+    def update(self, now, dt):
+        # a new set point every hold seconds or so
+        if now >= self.next_step:
+            self.level = self.rng.choice(self.levels)
+            self.next_step = now + self.rng.uniform(0.5, 1.5) * self.hold
+
+        self.value = self.level + self.rng.gauss(0, self.noise) if self.level else 0.0
+        return self.value
+
+
+class Totalizer:
+
+    def __init__(self, rng, source, sign, scale):
+        self.source = source
+        self.sign = sign
+        self.scale = scale
+
+        # a meter that has been running for a while
+        self.value = rng.uniform(0, 1000)
+
+    def update(self, now, dt):
+        # only flow in its own direction counts
+        rate = self.sign * self.source.value
+        if rate > 0:
+            self.value += rate * dt * self.scale
+        return self.value
+
+
+SIGNALS = {
+    "constant": Constant,
+    "sine": Sine,
+    "walk": RandomWalk,
+    "steps": Steps,
+    }
+
+
+#
+#   Channel
+#
+
+class Channel:
+
+    def __init__(self, rng, channel, base, offsets=None):
+        """The signals of one channel, the objects are only made when they
+        are first asked for."""
+        self.channel = channel
+
+        # (object identifier, template row, signal) in update order
+        self.entries = []
+        self.rows = {}
+
+        # objects made so far by identifier, and by name
+        self.objects = {}
+        self.names = {}
+
+        # faults apply to the whole channel
+        self.reliability = "noFaultDetected"
+
+        by_offset = {}
+        for row in CHANNEL_TEMPLATE:
+            offset, object_type, name, units, cov_increment, signal = row
+            if offsets is not None and offset not in offsets:
+                continue
+
+            # totalizers follow a signal made earlier in the same channel
+            kind, parameters = signal[0], signal[1:]
+            if kind == "total":
+                source, sign, scale = parameters
+                signal = Totalizer(rng, by_offset[source], sign, scale)
+            else:
+                signal = SIGNALS[kind](rng, *parameters)
+            by_offset[offset] = signal
+
+            identifier = (object_type, base + offset)
+            self.entries.append((identifier, row, signal))
+            self.rows[identifier] = (row, signal)
+            self.names["ch%s %s" % (channel, name)] = identifier
+
+    def identifiers(self):
+        return [identifier for identifier, row, signal in self.entries]
+
+    def make_object(self, identifier):
+        row, signal = self.rows[identifier]
+        offset, object_type, name, units, cov_increment, _ = row
+        fault = self.reliability != "noFaultDetected"
+
+        object_class = AnalogInputObject if object_type == "analogInput" else AnalogValueObject
+        obj = object_class(
+            objectIdentifier=identifier,
+            objectName="ch%s %s" % (self.channel, name),
+            presentValue=float(signal.value),
+            units=units,
+            covIncrement=cov_increment,
+            statusFlags=[0, int(fault), 0, 0],
+            eventState="fault" if fault else "normal",
+            reliability=self.reliability,
+            outOfService=False
+        )
+        self.objects[identifier] = obj
+        return obj
+
+    def update(self, now, dt):
+        for identifier, row, signal in self.entries:
+            value = signal.update(now, dt)
+
+            # nothing to do for objects nobody has asked for yet
+            obj = self.objects.get(identifier)
+            if obj is not None:
+                obj.presentValue = float(value)
+
+    def set_reliability(self, reliability):
+        self.reliability = reliability
+
+        fault = reliability != "noFaultDetected"
+        for obj in self.objects.values():
+            obj.reliability = reliability
+            obj.eventState = "fault" if fault else "normal"
+            obj.statusFlags = [0, int(fault), 0, 0]
+
+
+def make_channels(rng):
+    return [Channel(rng, channel, base, offsets) for channel, base, offsets in CHANNELS]
+
+
+#
+#   SignalEngine
+#
+
+class SignalEngine(RecurringTask):
+
+    def __init__(self, channels, interval, fault_rate, rng):
+        """Update every channel every interval seconds, each channel has
+        fault_rate faults an hour on average."""
+        RecurringTask.__init__(self, int(interval * 1000))
+        self.channels = channels
+        self.fault_rate = fault_rate
+        self.rng = rng
+
+        # when each faulted channel recovers
+        self.faults = {}
+
+        self.start = time.monotonic()
+        self.last_update = 0.0
+
+    def process_task(self):
+        now = time.monotonic() - self.start
+        dt = now - self.last_update
+        self.last_update = now
+
+        for channel in self.channels:
+            channel.update(now, dt)
+
+            # faults come and go per channel
+            if channel in self.faults:
+                if now >= self.faults[channel]:
+                    del self.faults[channel]
+                    channel.set_reliability("noFaultDetected")
+            elif self.fault_rate and self.rng.random() < self.fault_rate * dt / 3600.0:
+                self.faults[channel] = now + self.rng.uniform(10, 60)
+                channel.set_reliability(self.rng.choice(FAULT_RELIABILITY))
 
 
 class SampleApplication(
@@ -735,24 +306,114 @@ class SampleApplication(
     pass
 
 
+#
+#   FleetApplication
+#
+
+class FleetApplication(
+    BIPSimpleApplication, ReadWritePropertyMultipleServices, ChangeOfValueServices
+):
+
+    def __init__(self, channels, *args):
+        """One virtual device of a fleet, its objects are listed but only
+        made when a request first touches them."""
+        # capabilities are only found among the direct bases
+        BIPSimpleApplication.__init__(self, *args)
+
+        self.lazy_identifiers = {}
+        self.lazy_names = {}
+        for channel in channels:
+            for identifier in channel.identifiers():
+                self.lazy_identifiers[identifier] = channel
+                self.localDevice.objectList.append(identifier)
+            for name, identifier in channel.names.items():
+                self.lazy_names[name] = identifier
+
+    def get_object_id(self, objid):
+        obj = self.objectIdentifier.get(objid, None)
+        if obj is None and objid in self.lazy_identifiers:
+            obj = self.make_object(objid)
+        return obj
+
+    def get_object_name(self, objname):
+        obj = self.objectName.get(objname, None)
+        if obj is None and objname in self.lazy_names:
+            obj = self.get_object_id(self.lazy_names[objname])
+        return obj
+
+    def make_object(self, identifier):
+        obj = self.lazy_identifiers.pop(identifier).make_object(identifier)
+
+        # add_object would list it a second time
+        self.objectName[obj.objectName] = obj
+        self.objectIdentifier[identifier] = obj
+        obj._app = self
+        return obj
+
+
 def main():
     global test_application
 
     # make a parser
     parser = ConfigArgumentParser(description=__doc__)
 
+    # how the values move
+    parser.add_argument("--update-interval", type=float, default=1.0,
+        help="seconds between value updates",
+        )
+    parser.add_argument("--fault-rate", type=float, default=1.0,
+        help="faults per channel per hour",
+        )
+    parser.add_argument("--seed", type=int, default=None,
+        help="seed for repeatable values",
+        )
+
+    # many devices in one process
+    parser.add_argument("--fleet", type=int, default=0,
+        help="number of virtual devices, on consecutive ports and instances",
+        )
+
     # parse the command line arguments
     args = parser.parse_args()
 
-    # make a device object
-    this_device = LocalDeviceObject(ini=args.ini)
+    rng = random.Random(args.seed)
+    all_channels = []
+
+    if not args.fleet:
+        # make a device object
+        this_device = LocalDeviceObject(ini=args.ini)
+
+        # make a sample application
+        test_application = SampleApplication(this_device, args.ini.address)
+
+        # add the channels to the device
+        channels = make_channels(rng)
+        for channel in channels:
+            for identifier in channel.identifiers():
+                test_application.add_object(channel.make_object(identifier))
+        all_channels.extend(channels)
+
+    else:
+        # the ini file gives the first device, the rest follow on
+        host, _, port = args.ini.address.partition(":")
+        port = int(port or 47808)
+        instance = int(args.ini.objectidentifier)
+
+        test_application = []
+        for i in range(args.fleet):
+            this_device = LocalDeviceObject(
+                ini=args.ini,
+                objectName="%s-%d" % (args.ini.objectname, i),
+                objectIdentifier=("device", instance + i),
+                )
 
-    # make a sample application
-    test_application = SampleApplication(this_device, args.ini.address)
+            channels = make_channels(rng)
+            test_application.append(FleetApplication(channels, this_device, "%s:%d" % (host, port + i)))
+            all_channels.extend(channels)
 
-    # add it to the device
-    for eachObject in objectList:
-        test_application.add_object(eachObject)
+    # keep them moving
+    engine = SignalEngine(all_channels, args.update_interval, args.fault_rate, rng)
+    engine.install_task()
 
     run()
 
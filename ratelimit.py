@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Pacing for the writes to Timestream
+
+A token bucket holds the record rate under a ceiling, and an adaptive limit
+on the calls in flight backs off by half when a call is throttled and creeps
+back up by one call for every limit's worth of successes
+"""
+import threading
+import time
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   TokenBucket
+#
+@bacpypes_debugging
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        """Allow rate tokens a second on average and up to burst at once,
+        no limit at all when rate is 0."""
+        if _debug: TokenBucket._debug("__init__ %r %r", rate, burst)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, count):
+        """Wait until count tokens are available and use them."""
+        if not self.rate:
+            return
+
+        # take them now and sleep off whatever is owed, so callers queue up
+        # in the order they came
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait:
+            if _debug: TokenBucket._debug("    - wait %r", wait)
+            time.sleep(wait)
+
+#
+#   AdaptiveLimit
+#
+@bacpypes_debugging
+class AdaptiveLimit:
+
+    def __init__(self, minimum, maximum, decrease=0.5, cooldown=1.0):
+        """Between minimum and maximum calls in flight, starting at the
+        maximum, cut by the decrease factor at most once every cooldown
+        seconds so a burst of throttles counts as one."""
+        if _debug: AdaptiveLimit._debug("__init__ %r %r %r %r", minimum, maximum, decrease, cooldown)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+
+            now = time.monotonic()
+            if throttled:
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.last_decrease = now
+                    if _debug: AdaptiveLimit._debug("    - decrease %r", self.limit)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+            self.condition.notify_all()
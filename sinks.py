@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+
+"""
+Where the records go once a cycle has built them
+
+Records are built in the Timestream WriteRecords layout and each sink turns
+them into whatever its backend wants.  Every sink has a thread, a queue and
+an optional spool of its own, so a slow or unreachable backend only holds up
+itself.  Client libraries are imported when a sink starts, so only the
+configured backends are ever loaded.
+"""
+import json
+import math
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+from spool import Spool
+import metrics
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+upload_queue_depth = metrics.Gauge("flexim_upload_queue_depth", "Cycles waiting for each sink")
+upload_dropped = metrics.Counter("flexim_upload_dropped_cycles_total", "Cycles dropped because a sink's queue was full")
+spool_records = metrics.Gauge("flexim_spool_records", "Records waiting in each sink's spool")
+spool_bytes = metrics.Gauge("flexim_spool_bytes", "Size of the records waiting in each sink's spool")
+spool_evicted = metrics.Counter("flexim_spool_evicted_records_total", "Records evicted from a full spool")
+sink_records = metrics.Counter("flexim_sink_records_total", "Records written by each sink")
+sink_failures = metrics.Counter("flexim_sink_write_failures_total", "Batches each sink failed to write")
+sink_dropped = metrics.Counter("flexim_sink_dropped_records_total", "Records dropped because a sink could not handle them")
+
+#
+#   Sink
+#
+@bacpypes_debugging
+class Sink(threading.Thread):
+
+    def __init__(self, name, queue_size, batch_records, batch_seconds=0.0, spool_path=None, spool_max_bytes=0):
+        """Write batches of up to batch_records records, waiting up to
+        batch_seconds for a batch to fill, committing them to the spool first
+        when there is one."""
+        if _debug: Sink._debug("__init__ %r %r %r %r %r", name, queue_size, batch_records, batch_seconds, spool_path)
+        threading.Thread.__init__(self, name="sink-" + name, daemon=True)
+        self.sink_name = name
+        self.batch_records = batch_records
+        self.batch_seconds = batch_seconds
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+
+        # cycles of records waiting to be written, or to be committed to the
+        # spool, which never has to wait for the network so nothing is dropped
+        self.queue = queue.Queue(0 if spool_path else queue_size)
+
+        # cycles thrown away because the queue was full
+        self.dropped = 0
+
+        # opened by the thread itself, appended to by a committer thread and
+        # read by this one, taking turns
+        self.spool = None
+        self.spool_lock = threading.Lock()
+        self.committed = threading.Event()
+        self.evicted = 0
+
+    def put(self, records):
+        if _debug: Sink._debug("put %r %r", self.sink_name, len(records))
+
+        # never block the caller, make room by dropping the oldest cycle
+        while True:
+            try:
+                self.queue.put_nowait(records)
+                break
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                    upload_dropped.inc(sink=self.sink_name)
+                    print("Upload queue full, dropped oldest cycle for", self.sink_name)
+                except queue.Empty:
+                    pass
+        upload_queue_depth.set(self.queue.qsize(), sink=self.sink_name)
+
+    def open(self):
+        """Import the client library and connect, on the sink's thread."""
+        pass
+
+    def write(self, records):
+        """Send the records, false if they should be sent again."""
+        raise NotImplementedError("write must be overridden")
+
+    def run(self):
+        self.open()
+        if not self.spool_path:
+            while True:
+                records, cycles = self.next_batch()
+                if _debug: Sink._debug("run %r %r", self.sink_name, len(records))
+                self.send(records)
+                for cycle in range(cycles):
+                    self.queue.task_done()
+
+        self.spool = Spool(self.spool_path, self.spool_max_bytes)
+        self.spool_changed()
+        threading.Thread(target=self.commit, name="spool-" + self.sink_name, daemon=True).start()
+
+        # send what is in the spool each time more is committed, or retry
+        # after a failure when the next cycle comes in
+        while True:
+            self.committed.wait()
+
+            # give a batch time to fill
+            deadline = time.monotonic() + self.batch_seconds
+            while (self.spool.records < self.batch_records) and (time.monotonic() < deadline):
+                self.committed.clear()
+                self.committed.wait(deadline - time.monotonic())
+
+            self.committed.clear()
+            self.drain()
+
+    def commit(self):
+        # every cycle goes on the disk as it comes in, however long a send takes
+        while True:
+            records = self.queue.get()
+            if _debug: Sink._debug("commit %r %r", self.sink_name, len(records))
+            with self.spool_lock:
+                self.spool.append(records)
+                self.spool_changed()
+            self.queue.task_done()
+            upload_queue_depth.set(self.queue.qsize(), sink=self.sink_name)
+            self.committed.set()
+
+    def next_batch(self):
+        # wait for a cycle, then take more until the batch is full or has
+        # waited long enough
+        records = list(self.queue.get())
+        cycles = 1
+        deadline = time.monotonic() + self.batch_seconds
+        while len(records) < self.batch_records:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    records.extend(self.queue.get(timeout=timeout))
+                else:
+                    records.extend(self.queue.get_nowait())
+                cycles += 1
+            except queue.Empty:
+                break
+
+        upload_queue_depth.set(self.queue.qsize(), sink=self.sink_name)
+        return records, cycles
+
+    def flush(self, timeout):
+        """Wait up to timeout seconds for the cycles put so far to be written,
+        or committed when there is a spool, false if they weren't."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def send(self, records):
+        # a write that fails returns false to be tried again, one that raises
+        # would fail the same way every time and hold up everything behind it
+        try:
+            sent = self.write(records)
+        except Exception as err:
+            print("Error:", self.sink_name, err, "- dropping", len(records), "records")
+            sink_failures.inc(sink=self.sink_name)
+            sink_dropped.inc(len(records), sink=self.sink_name)
+            return True
+
+        if sent:
+            sink_records.inc(len(records), sink=self.sink_name)
+        else:
+            sink_failures.inc(sink=self.sink_name)
+        return sent
+
+    def drain(self):
+        if _debug: Sink._debug("drain %r", self.sink_name)
+
+        while True:
+            with self.spool_lock:
+                if not self.spool.records:
+                    return
+                last_id, records = self.spool.peek(self.batch_records)
+
+            # oldest first, stop and wait for the next cycle when offline
+            if not self.send(records):
+                if _debug: Sink._debug("    - %r records waiting", self.spool.records)
+                return
+
+            with self.spool_lock:
+                self.spool.remove(last_id)
+                self.spool_changed()
+
+    def spool_changed(self):
+        spool_records.set(self.spool.records, sink=self.sink_name)
+        spool_bytes.set(self.spool.size, sink=self.sink_name)
+        if self.spool.evicted != self.evicted:
+            spool_evicted.inc(self.spool.evicted - self.evicted, sink=self.sink_name)
+            self.evicted = self.spool.evicted
+
+#
+#   FileSink
+#
+@bacpypes_debugging
+class FileSink(Sink):
+
+    def __init__(self, path, *args, **kwargs):
+        """JSON lines, one file per UTC day of the records' time."""
+        if _debug: FileSink._debug("__init__ %r", path)
+        Sink.__init__(self, "file", *args, **kwargs)
+        self.path = path
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def write(self, records):
+        if _debug: FileSink._debug("write %r", len(records))
+
+        days = {}
+        for record in records:
+            day = time.strftime("%Y%m%d", time.gmtime(int(record['Time']) / 1000))
+            days.setdefault(day, []).append(json.dumps(record, separators=(',', ':')))
+
+        try:
+            for day, lines in days.items():
+                with open(os.path.join(self.path, day + ".jsonl"), "a") as records_file:
+                    records_file.write("\n".join(lines) + "\n")
+        except OSError as err:
+            print("Error:", err)
+            return False
+        return True
+
+#
+#   InfluxSink
+#
+@bacpypes_debugging
+class InfluxSink(Sink):
+
+    def __init__(self, url, org, bucket, token, *args, **kwargs):
+        """Line protocol to the InfluxDB 2 write API, which 1.8 has as well."""
+        if _debug: InfluxSink._debug("__init__ %r %r %r", url, org, bucket)
+        Sink.__init__(self, "influx", *args, **kwargs)
+        self.url = url.rstrip("/") + "/api/v2/write?" + urllib.parse.urlencode(
+            {'org': org, 'bucket': bucket, 'precision': 'ms'})
+        self.headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if token:
+            self.headers['Authorization'] = "Token " + token
+
+        # one buffer for every batch, and each series' measurement and tags
+        # escaped only the first time it turns up
+        self.buffer = bytearray()
+        self.prefixes = {}
+
+    def write(self, records):
+        if _debug: InfluxSink._debug("write %r", len(records))
+
+        body = self.buffer
+        del body[:]
+        for record in records:
+            line = _line(record, self.prefixes)
+            if line:
+                body += line.encode()
+                body += b"\n"
+        if not body:
+            return True
+
+        request = urllib.request.Request(self.url, data=body, headers=self.headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=20) as response:
+                response.read()
+        except urllib.error.HTTPError as err:
+            print("Error: InfluxDB", err.code, err.read()[:200])
+
+            # bad data won't be any better the second time
+            return (err.code < 500) and (err.code != 429)
+        except OSError as err:
+            print("Error: InfluxDB", err)
+            return False
+        return True
+
+#
+#   MqttSink
+#
+@bacpypes_debugging
+class MqttSink(Sink):
+
+    def __init__(self, host, port, topic, username, password, qos, *args, **kwargs):
+        """A JSON message per record on topic/<dimension values>/<measure name>."""
+        if _debug: MqttSink._debug("__init__ %r %r %r", host, port, topic)
+        Sink.__init__(self, "mqtt", *args, **kwargs)
+        self.host = host
+        self.port = port
+        self.topic = topic.rstrip("/")
+        self.username = username
+        self.password = password
+        self.qos = qos
+        self.client = None
+        self.connected = threading.Event()
+
+    def open(self):
+        import paho.mqtt.client as mqtt
+
+        # paho 2 wants to be told which callback signatures are in use
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        else:
+            self.client = mqtt.Client()
+        if self.username:
+            self.client.username_pw_set(self.username, self.password)
+        self.client.on_connect = lambda client, userdata, flags, rc: self.connected.set() if rc == 0 else None
+        self.client.on_disconnect = lambda client, userdata, rc: self.connected.clear()
+
+        # paho's own thread connects and reconnects in the background
+        self.client.connect_async(self.host, self.port)
+        self.client.loop_start()
+
+    def write(self, records):
+        if _debug: MqttSink._debug("write %r", len(records))
+
+        if not self.connected.wait(10):
+            print("Error: MQTT not connected to", self.host)
+            return False
+
+        messages = []
+        for record in records:
+            topic = "/".join([self.topic] + [dimension['Value'] for dimension in record['Dimensions']]
+                             + [record['MeasureName']])
+            payload = {'time': int(record['Time'])}
+            if 'MeasureValues' in record:
+                values = {value['Name']: _typed(value['Value'], value['Type']) for value in record['MeasureValues']}
+                payload['values'] = {name: value for name, value in values.items() if value is not None}
+                if not payload['values']:
+                    continue
+            else:
+                payload['value'] = _typed(record['MeasureValue'], record['MeasureValueType'])
+                if payload['value'] is None:
+                    continue
+            messages.append(self.client.publish(topic, json.dumps(payload, separators=(',', ':')), qos=self.qos))
+
+        # all of them on their way, or acknowledged for qos above 0
+        for message in messages:
+            if message.rc:
+                print("Error: MQTT publish", message.rc)
+                return False
+            message.wait_for_publish(10)
+            if not message.is_published():
+                return False
+        return True
+
+
+def _typed(value, value_type):
+    # record values are strings, back to what they were, None for what
+    # isn't a number when it should be
+    try:
+        if value_type == "DOUBLE":
+            return float(value)
+        if value_type == "BIGINT":
+            return int(value)
+    except ValueError:
+        return None
+    if value_type == "BOOLEAN":
+        return value == "true"
+    return value
+
+
+def _escape(value, characters):
+    value = value.replace("\\", "\\\\")
+    for character in characters:
+        value = value.replace(character, "\\" + character)
+    return value
+
+
+def _field(name, value, value_type):
+    # line protocol field, None for what InfluxDB can't store
+    if value_type == "DOUBLE":
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+        if not math.isfinite(value):
+            return None
+        value = repr(value)
+    elif value_type == "BIGINT":
+        if not value.lstrip("-").isdigit():
+            return None
+        value = value + "i"
+    elif value_type != "BOOLEAN":
+        value = '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return _escape(name, ", =") + "=" + value
+
+
+def _line(record, prefixes):
+    # measurement and dimensions as tags, the value or values as fields
+    if 'MeasureValues' in record:
+        fields = [_field(value['Name'], value['Value'], value['Type']) for value in record['MeasureValues']]
+    else:
+        fields = [_field("value", record['MeasureValue'], record['MeasureValueType'])]
+    fields = [field for field in fields if field is not None]
+    if not fields:
+        return None
+
+    key = (record['MeasureName'],) + tuple((dimension['Name'], dimension['Value']) for dimension in record['Dimensions'])
+    prefix = prefixes.get(key)
+    if prefix is None:
+        tags = "".join("," + _escape(dimension['Name'], ", =") + "=" + _escape(dimension['Value'], ", =")
+                       for dimension in sorted(record['Dimensions'], key=lambda dimension: dimension['Name']))
+        prefix = prefixes[key] = _escape(record['MeasureName'], ", ") + tags + " "
+    return prefix + ",".join(fields) + " " + record['Time']
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Store and forward spool for records waiting to be uploaded
+
+A SQLite database in WAL mode holding one row per cycle, oldest rows are
+evicted first when the spool grows past its size limit
+"""
+import json
+import sqlite3
+import zlib
+from bacpypes.debugging import bacpypes_debugging, ModuleLogger
+
+# some debugging
+_debug = 0
+_log = ModuleLogger(globals())
+
+#
+#   Spool
+#
+@bacpypes_debugging
+class Spool:
+
+    def __init__(self, path, max_bytes):
+        if _debug: Spool._debug("__init__ %r %r", path, max_bytes)
+        self.max_bytes = max_bytes
+
+        # WAL keeps a crash from corrupting the file and is gentler on SD cards,
+        # appending and sending are on different threads so the caller keeps
+        # them from overlapping
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cycles ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "count INTEGER NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "data BLOB NOT NULL)")
+        self.db.commit()
+
+        # running totals so nothing has to be counted on every append
+        self.records, self.size = self.db.execute("SELECT IFNULL(SUM(count), 0), IFNULL(SUM(size), 0) FROM cycles").fetchone()
+
+        # records thrown away to stay under the size limit
+        self.evicted = 0
+
+    def append(self, records):
+        if _debug: Spool._debug("append %r", len(records))
+
+        data = zlib.compress(json.dumps(records, separators=(',', ':')).encode(), 1)
+        self.db.execute("INSERT INTO cycles (count, size, data) VALUES (?, ?, ?)", (len(records), len(data), data))
+        self.records += len(records)
+        self.size += len(data)
+
+        # make room, oldest first
+        if self.size > self.max_bytes:
+            self._evict()
+
+        self.db.commit()
+
+    def peek(self, limit):
+        if _debug: Spool._debug("peek %r", limit)
+
+        # whole cycles, oldest first, until there are at least limit records
+        last_id = None
+        records = []
+        for row_id, data in self.db.execute("SELECT id, data FROM cycles ORDER BY id"):
+            records.extend(json.loads(zlib.decompress(data)))
+            last_id = row_id
+            if len(records) >= limit:
+                break
+
+        return last_id, records
+
+    def remove(self, last_id):
+        if _debug: Spool._debug("remove %r", last_id)
+
+        count, size = self.db.execute("SELECT IFNULL(SUM(count), 0), IFNULL(SUM(size), 0) FROM cycles WHERE id <= ?", (last_id,)).fetchone()
+        self.db.execute("DELETE FROM cycles WHERE id <= ?", (last_id,))
+        self.db.commit()
+        self.records -= count
+        self.size -= size
+
+    def _evict(self):
+        last_id = None
+        for row_id, count, size in self.db.execute("SELECT id, count, size FROM cycles ORDER BY id").fetchall():
+            if self.size <= self.max_bytes:
+                break
+            last_id = row_id
+            self.records -= count
+            self.size -= size
+            self.evicted += count
+
+        if last_id is not None:
+            print("Spool full, evicted oldest records up to cycle", last_id)
+            self.db.execute("DELETE FROM cycles WHERE id <= ?", (last_id,))